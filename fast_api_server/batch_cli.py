@@ -0,0 +1,75 @@
+# -----------------------------------------------------------
+# batch_cli.py
+#
+# Run a batch of design-agent turns without going through HTTP.
+#
+#   python -m fast_api_server.batch_cli --manifest rooms.jsonl > results.ndjson
+#   python -m fast_api_server.batch_cli --images-dir rooms/ --prompt "Living room, cozy, $2000"
+#
+# A manifest is JSON Lines, one ChatRequest per line (plus an optional "id").
+# Results are written to stdout as NDJSON in completion order.
+
+import argparse
+import asyncio
+import base64
+import json
+import mimetypes
+import os
+import sys
+from fast_api_server.models.design_agent_request import BatchChatItem
+from fast_api_server.services.batch_service import run_design_batch
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+
+
+def load_manifest(path):
+    items = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                items.append(BatchChatItem(**json.loads(line)))
+    return items
+
+
+def load_images_dir(path, prompt):
+    items = []
+    for name in sorted(os.listdir(path)):
+        if os.path.splitext(name)[1].lower() not in IMAGE_EXTENSIONS:
+            continue
+        content_type = mimetypes.guess_type(name)[0] or "image/jpeg"
+        with open(os.path.join(path, name), "rb") as f:
+            encoded = base64.b64encode(f.read()).decode("utf-8")
+        items.append(BatchChatItem(
+            id=name,
+            context=[],
+            user_prompt=prompt,
+            user_image=f"data:{content_type};base64,{encoded}"
+        ))
+    return items
+
+
+async def run(items, max_concurrency, out):
+    async for result in run_design_batch(items, max_concurrency):
+        out.write(json.dumps(result) + "\n")
+        out.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run design-agent turns in bulk and print NDJSON results.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--manifest", help="JSON Lines file, one ChatRequest per line")
+    source.add_argument("--images-dir", help="Directory of room photos, one item per image")
+    parser.add_argument("--prompt", default="", help="User prompt used with --images-dir")
+    parser.add_argument("--concurrency", type=int, default=None, help="Items in flight at once")
+    args = parser.parse_args(argv)
+
+    if args.manifest:
+        items = load_manifest(args.manifest)
+    else:
+        items = load_images_dir(args.images_dir, args.prompt)
+
+    asyncio.run(run(items, args.concurrency, sys.stdout))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,25 @@
 # main.py
-from fastapi import FastAPI
-from fast_api_server.routers import image_processing
+import time
+_import_started = time.perf_counter()
+
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from fast_api_server.routers import admin, design_session, health, image_processing
+from fast_api_server.services.warmup import shut_down, warm_up
+from fast_api_server.utils.metrics import metrics
+from fast_api_server.utils.request_limits import BodySizeLimitMiddleware, RequestLimitError
 from fastapi.middleware.cors import CORSMiddleware
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open clients and pools before taking traffic; /api/v1/ready flips once done
+    await warm_up()
+    yield
+    shut_down()
+
+
 app = FastAPI(
     title="Muralink Image Processing API",
     description="This API does awesome stuff and is deployed on Azure.",
@@ -15,7 +32,8 @@ app = FastAPI(
     license_info={
         "name": "MIT",
         "url": "https://opensource.org/licenses/MIT",
-    }
+    },
+    lifespan=lifespan
 )
 
 # Allow requests from your frontend (e.g., localhost:3000 during development)
@@ -26,6 +44,10 @@ origins = [
     # Add your production frontend domain here too when needed
 ]
 
+# Refuse oversized bodies before they are buffered or parsed. Added before
+# CORS so CORS stays the outermost layer and its headers reach early 413s too.
+app.add_middleware(BodySizeLimitMiddleware)
+
 # Add CORS middleware before defining your routes
 app.add_middleware(
     CORSMiddleware,
@@ -35,5 +57,16 @@ app.add_middleware(
     allow_headers=["*"],           # Allow all headers
 )
 
+
+@app.exception_handler(RequestLimitError)
+async def request_limit_handler(request: Request, exc: RequestLimitError):
+    return JSONResponse({"error": exc.detail}, status_code=exc.status_code, headers=exc.headers)
+
+
 # Include the router
-app.include_router(image_processing.router)
\ No newline at end of file
+app.include_router(image_processing.router)
+app.include_router(design_session.router)
+app.include_router(health.router)
+app.include_router(admin.router)
+
+metrics.set_gauge("startup.import_ms", round((time.perf_counter() - _import_started) * 1000, 1))
@@ -1,6 +1,7 @@
 
 from typing import List, Literal, Optional, Union
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field
+from fast_api_server.utils.config import concurrency_config
 
 class Message(BaseModel):
     role: Literal["user", "assistant"]  # Exclude 'system' from frontend
@@ -10,8 +11,42 @@ class ChatRequest(BaseModel):
     context: List[Message]
     user_prompt: str
     user_image: Optional[str] = None  # Base64 string or URL
+    tier: Optional[Literal["preview", "final"]] = None  # Model route, defaults to DEFAULT_TIER
+    session_id: Optional[str] = None  # Design session for token accounting, or the X-Session-Id header
 
 class DesignAgentImageGenerate(BaseModel):
     context: List[Message]
     user_image: str
-    product_image_urls: List[str]
\ No newline at end of file
+    product_image_urls: List[str]
+    regenerate: bool = False  # Skip the generated-design cache
+    tier: Optional[Literal["preview", "final"]] = None
+    variants: int = Field(1, ge=1, le=concurrency_config.max_variants)  # Alternative renders, at most MAX_VARIANTS
+    session_id: Optional[str] = None
+
+class DesignAgentImageStream(BaseModel):
+    # Progressive render: always a preview then the final route, so tier and variants are rejected
+    model_config = ConfigDict(extra="forbid")
+    context: List[Message]
+    user_image: str
+    product_image_urls: List[str]
+    regenerate: bool = False
+    session_id: Optional[str] = None
+
+class BatchChatItem(ChatRequest):
+    id: Optional[str] = None  # Caller's reference, echoed back in the result line
+
+class DesignAgentBatchRequest(BaseModel):
+    items: List[BatchChatItem]
+    max_concurrency: Optional[int] = None  # Capped by BATCH_MAX_CONCURRENCY
+
+class DesignSessionFrame(BaseModel):
+    # One client frame on the design session WebSocket
+    type: Literal["chat", "image", "generate", "reset", "cancel", "ping"]
+    id: Optional[str] = None  # Caller's reference, echoed in the turn's "done" / "error" event
+    prompt: Optional[str] = None  # chat
+    image: Optional[str] = None  # chat / image: base64 room photo, replaces the session's room image
+    tier: Optional[Literal["preview", "final"]] = None
+    products: List[int] = []  # generate: product ids from the last chat turn
+    product_image_urls: List[str] = []  # generate: extra product images
+    variants: int = Field(1, ge=1, le=concurrency_config.max_variants)
+    regenerate: bool = False
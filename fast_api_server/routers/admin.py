@@ -0,0 +1,41 @@
+# -----------------------------------------------------------
+# routers/admin.py
+
+import hmac
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException
+
+from fast_api_server.services.usage import total_tokens, usage_tracker
+from fast_api_server.utils.config import usage_config
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    # Disabled unless ADMIN_TOKEN is set
+    if not usage_config.admin_token or not x_admin_token or not hmac.compare_digest(x_admin_token, usage_config.admin_token):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+
+router = APIRouter(
+    prefix="/api/v1/admin",
+    tags=["Admin"],
+    dependencies=[Depends(require_admin)],
+)
+
+@router.get("/usage")
+async def get_usage():
+    # Token usage per endpoint and the heaviest sessions
+    return usage_tracker.snapshot()
+
+
+@router.get("/usage/sessions/{session_id}")
+async def get_session_usage(session_id: str):
+    usage = usage_tracker.session_usage(session_id)
+    budget = usage_config.session_token_budget
+    used = total_tokens(usage)
+    return {
+        "session_id": session_id,
+        "total_tokens": used,
+        **usage,
+        "budget": budget,
+        "remaining": max(budget - used, 0) if budget else None,
+    }
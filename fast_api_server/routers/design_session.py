@@ -0,0 +1,125 @@
+# -----------------------------------------------------------
+# routers/design_session.py
+
+import asyncio
+from typing import Optional
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
+from fast_api_server.models.design_agent_request import DesignSessionFrame
+
+from fast_api_server.services.design_session import DesignSession, design_sessions
+from fast_api_server.utils.config import design_session_config
+from fast_api_server.utils.fair_queue import fair_scheduler
+from fast_api_server.utils.logger import logger
+from fast_api_server.utils.metrics import metrics
+from fast_api_server.utils.rate_limit import check_rate_limit, client_key
+from fast_api_server.utils.request_context import request_scope
+from fast_api_server.utils.request_limits import RequestLimitError, check_and_estimate, memory_admission
+
+
+router = APIRouter(
+    prefix="/api/v1",
+    tags=["Design Session"],
+)
+
+
+async def send_event(websocket: WebSocket, event: dict):
+    try:
+        await websocket.send_json(event)
+    except (WebSocketDisconnect, RuntimeError):
+        # Socket already closed; the receive loop cancels the turn
+        pass
+
+
+async def run_turn(websocket: WebSocket, session: DesignSession, frame: DesignSessionFrame, key: str, closed: asyncio.Event):
+    """Run one chat / image / generate / reset frame under the same limits as the HTTP endpoints."""
+    async def is_disconnected():
+        return closed.is_set()
+
+    try:
+        async with session.lock:
+            if frame.type == "reset":
+                session.context, session.products = [], []
+            elif frame.type == "image":
+                if not frame.image:
+                    raise ValueError("An image frame needs an image")
+                check_and_estimate([frame.image])
+                await session.set_room_image(frame.image)
+            elif frame.type == "chat":
+                await check_rate_limit("chat", key)
+                estimate = check_and_estimate([frame.image], len(frame.prompt or "") + len(frame.image or ""))
+                async with request_scope(websocket, "chat", watch_disconnect=False, session_id=session.session_id), \
+                        fair_scheduler("chat").slot(key), memory_admission.reserve(estimate):
+                    async for event in session.chat(frame.prompt or "", frame.image, frame.tier):
+                        await send_event(websocket, event)
+            else:
+                await check_rate_limit("generation", key, frame.variants)
+                product_image_urls = session.product_image_urls(frame.products) + frame.product_image_urls
+                if not product_image_urls:
+                    raise ValueError("Choose at least one product")
+                estimate = check_and_estimate([session.room_image] + product_image_urls)
+                async with request_scope(websocket, "generation", watch_disconnect=False, session_id=session.session_id), \
+                        fair_scheduler("generation").slot(key, frame.variants), memory_admission.reserve(estimate):
+                    async for event in session.generate(product_image_urls, frame.variants, frame.regenerate, frame.tier, is_disconnected):
+                        await send_event(websocket, event)
+        design_sessions.touch(session)
+        await send_event(websocket, {"type": "done", "id": frame.id, "request": frame.type, "turns": session.turns})
+    except RequestLimitError as e:
+        await send_event(websocket, {"type": "error", "id": frame.id, "status": e.status_code, "error": e.detail})
+    except asyncio.CancelledError:
+        if not closed.is_set():
+            await send_event(websocket, {"type": "cancelled", "id": frame.id})
+        raise
+    except Exception as e:
+        logger.error(f"Error in design session {session.session_id}: {str(e)}")
+        await send_event(websocket, {"type": "error", "id": frame.id, "error": str(e)})
+
+
+@router.websocket("/design-agent/session")
+async def design_agent_session(websocket: WebSocket, session_id: Optional[str] = None):
+    """
+    Design chat over one WebSocket. The conversation lives server-side, so
+    each turn is a small JSON frame; replies stream back as events.
+    Reconnect with ?session_id= to resume a session; only the client that
+    created it may.
+    """
+    await websocket.accept()
+    key = client_key(websocket)
+    try:
+        session = design_sessions.get_or_create(session_id or websocket.headers.get("x-session-id"), key)
+    except PermissionError as e:
+        await websocket.close(code=4403, reason=str(e))
+        return
+    closed = asyncio.Event()
+    turn = None
+    metrics.increment("design_session.connections")
+    await send_event(websocket, session.summary())
+    try:
+        while True:
+            message = await websocket.receive_text()
+            if len(message) > design_session_config.max_frame_bytes:
+                await send_event(websocket, {"type": "error", "status": 413, "error": "Frame too large"})
+                continue
+            try:
+                frame = DesignSessionFrame.model_validate_json(message)
+            except ValidationError as e:
+                await send_event(websocket, {"type": "error", "status": 422, "error": e.errors(include_url=False, include_context=False)})
+                continue
+
+            if frame.type == "ping":
+                await send_event(websocket, {"type": "pong", "id": frame.id})
+            elif frame.type == "cancel":
+                if turn is not None:
+                    turn.cancel()
+            elif turn is not None and not turn.done():
+                await send_event(websocket, {"type": "error", "id": frame.id, "status": 409, "error": "A turn is already running"})
+            else:
+                metrics.increment(f"design_session.frames.{frame.type}")
+                turn = asyncio.ensure_future(run_turn(websocket, session, frame, key, closed))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        closed.set()
+        if turn is not None and not turn.done():
+            turn.cancel()
+            metrics.increment("cancellation.design_session.disconnect")
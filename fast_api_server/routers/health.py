@@ -0,0 +1,33 @@
+# -----------------------------------------------------------
+# routers/health.py
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from fast_api_server.services.warmup import readiness
+from fast_api_server.utils.metrics import metrics
+
+
+router = APIRouter(
+    prefix="/api/v1",
+    tags=["Health"],
+)
+
+@router.get("/health")
+async def health():
+    # Liveness: the process is up and serving
+    return {"status": "ok"}
+
+
+@router.get("/ready")
+async def ready():
+    # Readiness: only once the startup warm-up has finished
+    body = {"ready": readiness.ready, "steps_ms": readiness.steps}
+    if readiness.error:
+        body["error"] = readiness.error
+    return JSONResponse(body, status_code=200 if readiness.ready else 503)
+
+
+@router.get("/metrics")
+async def get_metrics():
+    return metrics.snapshot()
@@ -1,10 +1,22 @@
 # -----------------------------------------------------------
 # routers/image_processing.py 
 
-from fastapi import APIRouter
-from fast_api_server.models.design_agent_request import ChatRequest, DesignAgentImageGenerate
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import StreamingResponse
+from fast_api_server.models.design_agent_request import ChatRequest, DesignAgentBatchRequest, DesignAgentImageGenerate, DesignAgentImageStream
 
-from fast_api_server.services.design_agent_service import design_assistant, design_assistant_image_generation
+from fast_api_server.services.batch_service import run_design_batch
+from fast_api_server.services.design_agent_service import (
+    design_assistant,
+    design_assistant_image_generation,
+    generate_design_variants,
+    progressive_image_generation,
+)
+from fast_api_server.utils.fair_queue import fair_scheduler
+from fast_api_server.utils.rate_limit import check_rate_limit, client_key, rate_limit
+from fast_api_server.utils.request_context import request_scope
+from fast_api_server.utils.request_limits import RequestLimitError, check_and_estimate, memory_admission
+from fast_api_server.utils.streaming import stream_ndjson
 
 
 router = APIRouter(
@@ -13,19 +25,85 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
+def body_bytes(request: Request) -> int:
+    content_length = request.headers.get("content-length", "")
+    return int(content_length) if content_length.isdigit() else 0
+
+
 @router.post("/design-agent")
-async def design_agent(req: ChatRequest):
-    try:
-        response = await design_assistant(req.context, req.user_prompt, req.user_image)
-        return response
-    except Exception as e:
-        return {"error": str(e)}
+async def design_agent(req: ChatRequest, request: Request, client_key: str = Depends(rate_limit("chat"))):
+    # Refuse oversized requests up front, take a fair turn, then wait for memory budget
+    estimate = check_and_estimate([req.user_image], body_bytes(request), req.context)
+    async with request_scope(request, "chat", session_id=req.session_id), fair_scheduler("chat").slot(client_key), memory_admission.reserve(estimate):
+        try:
+            response = await design_assistant(req.context, req.user_prompt, req.user_image, tier=req.tier)
+            return response
+        except RequestLimitError:
+            raise
+        except Exception as e:
+            return {"error": str(e)}
     
 
 @router.post("/design-agent/generate-image")
-async def design_agent_image_gen(req: DesignAgentImageGenerate):
-    try:
-        response = await design_assistant_image_generation(req.context, req.user_image, req.product_image_urls)
-        return response
-    except Exception as e:
-        return {"error": str(e)}
\ No newline at end of file
+async def design_agent_image_gen(req: DesignAgentImageGenerate, request: Request, key: str = Depends(client_key)):
+    # Every variant is a render, so each costs a generation token
+    await check_rate_limit("generation", key, req.variants)
+    estimate = check_and_estimate([req.user_image] + req.product_image_urls, body_bytes(request), req.context)
+    async with request_scope(request, "generation", session_id=req.session_id), fair_scheduler("generation").slot(key, req.variants), memory_admission.reserve(estimate):
+        try:
+            if req.variants > 1:
+                variants = generate_design_variants(req.context, req.user_image, req.product_image_urls, req.variants, req.regenerate, req.tier)
+                results = sorted([variant async for variant in variants], key=lambda variant: variant["index"])
+                return {"images": [variant["image"] for variant in results]}
+            response = await design_assistant_image_generation(req.context, req.user_image, req.product_image_urls, req.regenerate, req.tier)
+            return response
+        except RequestLimitError:
+            raise
+        except Exception as e:
+            return {"error": str(e)}
+
+
+@router.post("/design-agent/generate-image/stream")
+async def design_agent_image_gen_stream(req: DesignAgentImageStream, request: Request, client_key: str = Depends(rate_limit("generation"))):
+    # NDJSON events: a quick preview, partial images of the final render, then the final image
+    estimate = check_and_estimate([req.user_image] + req.product_image_urls, body_bytes(request), req.context)
+
+    async def events():
+        # Headers are already sent once this runs, so admission failures become error events too
+        try:
+            async with request_scope(request, "generation", watch_disconnect=False, session_id=req.session_id), fair_scheduler("generation").slot(client_key), memory_admission.reserve(estimate):
+                async for event in progressive_image_generation(req.context, req.user_image, req.product_image_urls, req.regenerate, request.is_disconnected):
+                    yield event
+        except RequestLimitError as e:
+            yield {"type": "error", "status": e.status_code, "error": e.detail}
+        except Exception as e:
+            yield {"type": "error", "error": str(e)}
+
+    return StreamingResponse(stream_ndjson(events()), media_type="application/x-ndjson")
+
+
+@router.post("/design-agent/generate-image/variants")
+async def design_agent_image_gen_variants(req: DesignAgentImageGenerate, request: Request, key: str = Depends(client_key)):
+    # NDJSON: one {"type": "variant", "index", "image"} line per render as it finishes
+    await check_rate_limit("generation", key, req.variants)
+    estimate = check_and_estimate([req.user_image] + req.product_image_urls, body_bytes(request), req.context)
+
+    async def events():
+        # Headers are already sent once this runs, so admission failures become error events too
+        try:
+            async with request_scope(request, "generation", watch_disconnect=False, session_id=req.session_id), fair_scheduler("generation").slot(key, req.variants), memory_admission.reserve(estimate):
+                async for event in generate_design_variants(req.context, req.user_image, req.product_image_urls, req.variants, req.regenerate, req.tier):
+                    yield event
+        except RequestLimitError as e:
+            yield {"type": "error", "status": e.status_code, "error": e.detail}
+        except Exception as e:
+            yield {"type": "error", "error": str(e)}
+
+    return StreamingResponse(stream_ndjson(events()), media_type="application/x-ndjson")
+
+
+@router.post("/design-agent/batch")
+async def design_agent_batch(req: DesignAgentBatchRequest, client_key: str = Depends(rate_limit("batch"))):
+    # One NDJSON line per item, streamed as each item finishes
+    results = run_design_batch(req.items, req.max_concurrency, client_key)
+    return StreamingResponse(stream_ndjson(results), media_type="application/x-ndjson")
@@ -0,0 +1,64 @@
+import asyncio
+import time
+from contextlib import nullcontext
+from typing import AsyncIterator, Dict, List, Optional
+from fast_api_server.services.design_agent_service import design_assistant
+from fast_api_server.utils.config import concurrency_config
+from fast_api_server.utils.fair_queue import fair_scheduler
+from fast_api_server.utils.logger import logger
+from fast_api_server.utils.request_limits import check_and_estimate, memory_admission
+
+
+async def run_design_batch(items: List, max_concurrency: Optional[int] = None, client_key: Optional[str] = None) -> AsyncIterator[Dict]:
+    """
+    Run many design-agent turns with bounded concurrency.
+
+    Items share one product search cache, so rooms that end up with the same
+    product queries only hit SerpAPI once. Upstream OpenAI / SerpAPI / resize
+    limits still apply on top of the per-batch item limit.
+
+    Args:
+        items (list): ChatRequest-like objects (context, user_prompt, user_image, optional id)
+        max_concurrency (int): Items in flight at once, capped by BATCH_MAX_CONCURRENCY
+        client_key (str): Caller for fair queuing; when set, each item takes a
+            turn in the chat fair queue alongside live requests
+
+    Yields:
+        dict: One result per item, in completion order
+    """
+    limit = concurrency_config.batch_item_limit
+    if max_concurrency:
+        limit = max(1, min(max_concurrency, limit))
+    semaphore = asyncio.Semaphore(limit)
+    search_cache = {}
+
+    def fair_slot(key):
+        return fair_scheduler("chat").slot(key) if key else nullcontext()
+
+    async def run_item(index, item):
+        async with semaphore:
+            started = time.perf_counter()
+            result = {"index": index, "id": getattr(item, "id", None)}
+            try:
+                estimate = check_and_estimate([item.user_image], context=item.context)
+                # Batches wait for memory budget rather than fail
+                async with fair_slot(client_key), memory_admission.reserve(estimate, wait_ms=0):
+                    response = await design_assistant(item.context, item.user_prompt, item.user_image, search_cache, item.tier)
+                result.update({"status": "ok", "result": response})
+            except Exception as e:
+                logger.error(f"Batch item {index} failed: {str(e)}")
+                result.update({"status": "error", "error": str(e)})
+            result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            return result
+
+    logger.info(f"Starting design batch of {len(items)} items with concurrency {limit}")
+    tasks = [asyncio.ensure_future(run_item(i, item)) for i, item in enumerate(items)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+        for task in search_cache.values():
+            task.cancel()
+    logger.info(f"Completed design batch, {len(search_cache)} unique product searches")
@@ -0,0 +1,94 @@
+import asyncio
+from typing import Dict, List
+from fast_api_server.services.image_utils import CHAT, image_content_hash, reference_resize_base64, resize_profile
+from fast_api_server.utils.config import image_config
+from fast_api_server.utils.logger import logger
+
+DUPLICATE_IMAGE_TEXT = "[Same image as shown earlier in the conversation]"
+OMITTED_IMAGE_TEXT = "[Image omitted to keep the request small]"
+
+
+def message_to_dict(message) -> Dict:
+    """Turn a Message model (or an already plain dict) into a plain dict."""
+    if hasattr(message, "model_dump"):
+        return message.model_dump()
+    return dict(message)
+
+
+def data_url_media_type(image_url: str) -> str:
+    if image_url.startswith("data:") and ";" in image_url:
+        return image_url[5:image_url.index(";")]
+    return "image/jpeg"
+
+
+async def prepare_context(context, byte_budget: int = None, profile: str = CHAT) -> List[Dict]:
+    """
+    Downscale and dedupe the images embedded in a multimodal conversation context.
+
+    Every inline (data URL) input_image part goes through the cached resize
+    pipeline. Repeats of an image already shown earlier in the conversation are
+    replaced with a short text note, and once the resized images exceed the
+    per-request byte budget the oldest ones are replaced too, so the upload
+    no longer grows with the length of the history. Remote image URLs are left
+    for OpenAI to fetch.
+
+    Args:
+        context (list): Message models or dicts with "role" and "content"
+        byte_budget (int): Max base64 bytes of context images, defaults to CONTEXT_IMAGE_BYTE_BUDGET
+        profile (str): Resize profile for the images, which also sets their detail level
+
+    Returns:
+        list: New list of message dicts, safe to send to client.responses.create
+    """
+    if byte_budget is None:
+        byte_budget = image_config.context_image_byte_budget
+
+    messages = [message_to_dict(message) for message in context]
+
+    # Collect every inline image part, oldest first
+    parts = []
+    for message in messages:
+        content = message.get("content")
+        if not isinstance(content, list):
+            continue
+        message["content"] = content = [dict(part) for part in content]
+        for index, part in enumerate(content):
+            image_url = part.get("image_url")
+            if part.get("type") == "input_image" and isinstance(image_url, str) and image_url.startswith("data:"):
+                parts.append((content, index))
+
+    if not parts:
+        return messages
+
+    resized = await asyncio.gather(*[reference_resize_base64(content[index]["image_url"], profile) for content, index in parts])
+
+    # Keep the first copy of each image; later copies become a text note
+    unique = []
+    seen = set()
+    for (content, index), image_base64 in zip(parts, resized):
+        key = image_content_hash(image_base64)
+        if key in seen:
+            content[index] = {"type": "input_text", "text": DUPLICATE_IMAGE_TEXT}
+            continue
+        seen.add(key)
+        unique.append((content, index, image_base64))
+
+    # Spend the byte budget on the most recent images first; once an image no
+    # longer fits, it and every older one are dropped, never a newer one
+    used_bytes = 0
+    omitted = 0
+    for content, index, image_base64 in reversed(unique):
+        if omitted or used_bytes + len(image_base64) > byte_budget:
+            content[index] = {"type": "input_text", "text": OMITTED_IMAGE_TEXT}
+            omitted += 1
+            continue
+        used_bytes += len(image_base64)
+        media_type = data_url_media_type(content[index]["image_url"])
+        content[index] = dict(content[index], image_url=f"data:{media_type};base64,{image_base64}",
+                              detail=resize_profile(profile).detail)
+
+    logger.info(
+        f"Prepared context images: {len(parts)} found, {len(parts) - len(unique)} duplicates, "
+        f"{omitted} over budget, {used_bytes} bytes sent"
+    )
+    return messages
@@ -1,50 +1,95 @@
-import base64
 import os
 import asyncio
-from typing import Dict, List
-import requests
-from serpapi import GoogleSearch
-from fast_api_server.services.image_utils import resize_all_images
+from typing import Dict, List, Optional
+from fast_api_server.services.context_utils import prepare_context
+from fast_api_server.services.generation_cache import generation_cache, generation_cache_key
+from fast_api_server.services.image_utils import (
+    CHAT,
+    PRODUCT,
+    ROOM,
+    fetch_cache,
+    reference_resize_base64,
+    resize_all_images,
+    resize_profile,
+    sync_fetch_image,
+)
+from fast_api_server.services.model_router import FINAL, PREVIEW, create_routed_response, model_router, stream_routed_response
+from fast_api_server.services.prefetch import prefetcher
+from fast_api_server.services.retrieval import knowledge_retriever
 from fast_api_server.services.text_utils import parse_product_list
-from fast_api_server.utils.openai_client import client
+from fast_api_server.services.usage import apply_session_budget, estimate_request_tokens, generated_image_tokens
+from fast_api_server.utils.concurrency import image_fetch_limiter, run_blocking, serp_limiter
+from fast_api_server.utils.config import concurrency_config, retrieval_config
 from fast_api_server.utils.logger import logger
+from fast_api_server.utils.metrics import metrics
 from fast_api_server.utils.prompt import DESIGN_AGENT_SYS_PROMPT, DESIGN_AGENT_IMG_SYS_PROMPT
+from fast_api_server.utils.request_context import checkpoint, current_request, stage_timeout
+from fast_api_server.utils.request_limits import RequestLimitError
+from fast_api_server.utils.streaming import drain_events
 
-async def search_product_on_google_shopping(product_name, properties=None):
+# Partial images streamed by a progressive final render
+PARTIAL_IMAGES = 2
+
+# Upstream timeouts (cut to the request deadline) and the least time worth starting with
+SERP_TIMEOUT_S = 20
+SERP_MIN_BUDGET_S = 1
+IMAGE_FETCH_TIMEOUT_S = 15
+IMAGE_FETCH_MIN_BUDGET_S = 0.5
+
+def build_search_query(product_name, properties=None):
     """
-    Search for a product on Google Shopping using SerpAPI
+    Build the Google Shopping query for a product
     
     Args:
         product_name (str): The name of the product to search
         properties (list): List of product properties to enhance search
         
     Returns:
-        dict: Search results from Google Shopping or None if error
+        str: Product name combined with its key properties
     """
-    try:
-        # Build search query - combine product name with key properties
-        search_query = product_name
-        if properties:
-            # Add relevant properties to search query (limit to avoid too long queries)
-            relevant_props = []
-            for prop in properties[:2]:  # Take first 2 properties
-                if any(keyword in prop.lower() for keyword in ['color', 'material', 'style', 'size']):
-                    relevant_props.append(prop)
-            if relevant_props:
-                search_query += " " + " ".join(relevant_props)
-        
-        # Configure SerpAPI search
-        params = {
-            "engine": "google_shopping",
-            "q": search_query,
-            "api_key": os.getenv("SERP_API_KEY"),  # Make sure to set this in your environment
-            "num": 5,  # Limit to top 5 results
-            "hl": "en",
-            "gl": "us"
-        }
+    search_query = product_name
+    if properties:
+        # Add relevant properties to search query (limit to avoid too long queries)
+        relevant_props = []
+        for prop in properties[:2]:  # Take first 2 properties
+            if any(keyword in prop.lower() for keyword in ['color', 'material', 'style', 'size']):
+                relevant_props.append(prop)
+        if relevant_props:
+            search_query += " " + " ".join(relevant_props)
+    return search_query
+
+def sync_google_shopping_search(search_query, timeout=None):
+    from serpapi import GoogleSearch
+
+    # Configure SerpAPI search
+    params = {
+        "engine": "google_shopping",
+        "q": search_query,
+        "api_key": os.getenv("SERP_API_KEY"),  # Make sure to set this in your environment
+        "num": 5,  # Limit to top 5 results
+        "hl": "en",
+        "gl": "us"
+    }
+    
+    search = GoogleSearch(params)
+    if timeout:
+        search.timeout = timeout
+    return search.get_dict()
+
+async def fetch_google_shopping_results(search_query, product_name):
+    """
+    Run one Google Shopping search through SerpAPI and format the results
+    
+    Args:
+        search_query (str): Query built by build_search_query
+        product_name (str): The product name, used for logging
         
-        search = GoogleSearch(params)
-        results = search.get_dict()
+    Returns:
+        dict: Search results from Google Shopping
+    """
+    checkpoint("product_search", SERP_MIN_BUDGET_S)
+    try:
+        results = await run_blocking(serp_limiter(), sync_google_shopping_search, search_query, stage_timeout(SERP_TIMEOUT_S))
         
         # Extract shopping results
         shopping_results = results.get("shopping_results", [])
@@ -73,64 +118,115 @@ async def search_product_on_google_shopping(product_name, properties=None):
     except Exception as e:
         logger.error(f"Error searching for product '{product_name}': {str(e)}")
         return {
-            "search_query": search_query if 'search_query' in locals() else product_name,
+            "search_query": search_query,
             "results_count": 0,
             "shopping_results": [],
             "error": str(e)
         }
 
-async def search_all_products(product_list):
+async def search_product_on_google_shopping(product_name, properties=None, search_cache: Optional[Dict] = None):
+    """
+    Search for a product on Google Shopping using SerpAPI
+    
+    Args:
+        product_name (str): The name of the product to search
+        properties (list): List of product properties to enhance search
+        search_cache (dict): Optional query -> task map shared between requests
+            (e.g. a batch) so identical searches only hit SerpAPI once
+        
+    Returns:
+        dict: Search results from Google Shopping or None if error
+    """
+    search_query = build_search_query(product_name, properties)
+    if search_cache is None:
+        return await fetch_google_shopping_results(search_query, product_name)
+
+    task = search_cache.get(search_query)
+    if task is None:
+        task = asyncio.ensure_future(fetch_google_shopping_results(search_query, product_name))
+        search_cache[search_query] = task
+    # Shield so one caller being cancelled doesn't cancel the search for the others
+    return await asyncio.shield(task)
+
+def no_search_results(search_query):
+    return {
+        "search_query": search_query,
+        "results_count": 0,
+        "shopping_results": [],
+        "error": "Search failed"
+    }
+
+async def search_all_products(product_list, search_cache: Optional[Dict] = None, on_product=None):
     """
     Search for all products in the list concurrently
     
     Args:
         product_list (list): List of product dictionaries
+        search_cache (dict): Optional shared search cache, see search_product_on_google_shopping
+        on_product (callable): If given, called with each enhanced product as its search finishes
         
     Returns:
         list: Enhanced product list with search results
     """
     if not product_list:
         return []
-    
-    # Create tasks for concurrent searching
-    search_tasks = []
-    for product in product_list:
-        task = search_product_on_google_shopping(
+
+    def enhance(i, product, search_result):
+        return {
+            "id": i + 1,
+            "name": product["name"],
+            "properties": product.get("properties", []),
+            "shopping_search": search_result if not isinstance(search_result, Exception) else no_search_results(product["name"])
+        }
+
+    async def search(i, product):
+        result = await search_product_on_google_shopping(
             product["name"], 
-            product.get("properties", [])
+            product.get("properties", []),
+            search_cache
         )
-        search_tasks.append(task)
+        if on_product is not None:
+            on_product(enhance(i, product, result))
+        return result
     
     # Execute all searches concurrently
-    search_results = await asyncio.gather(*search_tasks, return_exceptions=True)
+    search_results = await asyncio.gather(*[search(i, product) for i, product in enumerate(product_list)], return_exceptions=True)
+
+    # A cancelled or out-of-time request stops here rather than returning empty results
+    for result in search_results:
+        if isinstance(result, RequestLimitError):
+            raise result
     
     # Combine products with their search results
-    enhanced_products = []
-    for i, product in enumerate(product_list):
-        enhanced_product = {
-            "id": i + 1,
-            "name": product["name"],
-            "properties": product.get("properties", []),
-            "shopping_search": search_results[i] if i < len(search_results) and not isinstance(search_results[i], Exception) else {
-                "search_query": product["name"],
-                "results_count": 0,
-                "shopping_results": [],
-                "error": "Search failed"
-            }
-        }
-        enhanced_products.append(enhanced_product)
-    
-    return enhanced_products
+    return [enhance(i, product, search_results[i]) for i, product in enumerate(product_list)]
+
+async def design_assistant(context, user_prompt, user_image=None, search_cache: Optional[Dict] = None, tier: Optional[str] = None,
+                           on_text_delta=None, on_product=None):
+    """
+    One design chat turn: the assistant reply and Google Shopping results for
+    the products it lists.
+
+    Args:
+        on_text_delta (callable): If given, the reply is streamed and this is
+            called with each text delta, on a worker thread
+        on_product (callable): If given, called with each product as its search finishes
+    """
+    # Near the session's token budget, trim the history and use the cheaper route
+    context, tier = apply_session_budget(
+        context, tier,
+        estimate_request_tokens(context, DESIGN_AGENT_SYS_PROMPT, user_prompt or "", resize_profile(CHAT).image_tokens() if user_image else 0)
+    )
 
-async def design_assistant(context, user_prompt, user_image=None):
     # Resize images before processing
     resized_user_image = None
     resized_reference_images = []
     
-    # Resize user image if provided
-    if user_image:
-        resized_user_images = await resize_all_images([user_image])
-        resized_user_image = resized_user_images[0] if resized_user_images else None
+    # Resize user image if provided, and the images already in the conversation
+    resized_user_images, context = await asyncio.gather(
+        resize_all_images([user_image] if user_image else None, CHAT),
+        prepare_context(context)
+    )
+    resized_user_image = resized_user_images[0] if resized_user_images else None
     
     # Build the content for the new message
     message_content = []
@@ -146,7 +242,8 @@ async def design_assistant(context, user_prompt, user_image=None):
     if resized_user_image:
         message_content.append({
             "type": "input_image",
-            "image_url": f"data:image/jpeg;base64,{resized_user_image}"
+            "image_url": f"data:image/jpeg;base64,{resized_user_image}",
+            "detail": resize_profile(CHAT).detail
         })
     
     # Build the complete message array
@@ -162,10 +259,15 @@ async def design_assistant(context, user_prompt, user_image=None):
     ]
 
     try:
-        response = client.responses.create(
-            model="gpt-4.1-mini",
-            input=message
-        )
+        route = model_router.select("design_agent", tier)
+        if on_text_delta is None:
+            response = await create_routed_response(route, input=message)
+        else:
+            def on_event(event):
+                if event.type == "response.output_text.delta":
+                    on_text_delta(event.delta)
+
+            response = await stream_routed_response(route, on_event, input=message)
 
         # Parse product list from response
         product_list = parse_product_list(response.output[0].content[0].text)
@@ -174,8 +276,10 @@ async def design_assistant(context, user_prompt, user_image=None):
         enhanced_product_list = []
         if product_list:
             logger.info(f"Found {len(product_list)} products, starting Google Shopping search...")
-            enhanced_product_list = await search_all_products(product_list)
+            enhanced_product_list = await search_all_products(product_list, search_cache, on_product)
             logger.info(f"Completed product searches for {len(enhanced_product_list)} products")
+            # Users pick from these; get their images ready for /generate-image
+            prefetcher.schedule_products(enhanced_product_list)
         
         # Return the response with enhanced product information
         return {
@@ -193,60 +297,145 @@ async def design_assistant(context, user_prompt, user_image=None):
         logger.error(f"Error in design_assistant: {str(e)}")
         raise
 
-# Sync function to fetch and convert image to base64
-def sync_image_to_base64(url: str) -> str:
-    response = requests.get(url)
-    if response.status_code != 200:
-        raise Exception(f"Failed to fetch image from {url}")
+# Async wrapper around the sync fetch, served from the fetch cache when prefetched
+async def fetch_image(url: str) -> bytes:
+    cached = fetch_cache.get(url)
+    if cached is not None:
+        metrics.increment("fetch_cache.hits")
+        return cached
+    metrics.increment("fetch_cache.misses")
+    checkpoint("image_fetch", IMAGE_FETCH_MIN_BUDGET_S)
+    image = await run_blocking(image_fetch_limiter(), sync_fetch_image, url, stage_timeout(IMAGE_FETCH_TIMEOUT_S))
+    fetch_cache.put(url, image)
+    return image
 
-    content_type = response.headers.get("Content-Type", "image/jpeg")
-    encoded = base64.b64encode(response.content).decode("utf-8")
-    return f"data:{content_type};base64,{encoded}"
+class PreparedGeneration:
+    """
+    Inputs of a design render, prepared once and shared by every render of
+    the same request (preview and final).
+    """
+    def __init__(self, resized_images, context, prompt_route, tier=None, image_details=None):
+        self.resized_images = resized_images
+        self.context = context
+        self.prompt_route = prompt_route
+        # Route tier after the session budget check; renders use it unless told otherwise
+        self.tier = tier
+        # input_image detail level per image, from its resize profile
+        self.image_details = image_details or ["auto"] * len(resized_images)
+        self.prompt = None
+        self.prompt_lock = asyncio.Lock()
+        # Construct user content with input_image format
+        self.user_content = [
+            {
+                "type": "input_image",
+                "image_url": f"data:image/png;base64,{image_base64}",
+                "detail": detail
+            } for image_base64, detail in zip(resized_images, self.image_details)
+        ]
 
-# Async wrapper around the sync function
-async def image_to_base64(url: str) -> str:
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, sync_image_to_base64, url)
+    def cache_key(self, image_route, variant=0):
+        # Same room, products, conversation and settings as a previous design -> same key
+        settings = {"prompt": self.prompt_route.to_dict(), "image": image_route.to_dict(), "details": self.image_details}
+        if variant:
+            settings["variant"] = variant
+        return generation_cache_key(self.resized_images, self.context, settings)
 
-# Your main function that handles image conversion and resizing
-async def design_assistant_image_generation(context, user_image: str, product_image_urls: List[str]) -> str:
-    # Convert product image URLs to base64
-    product_images_base64 = await asyncio.gather(*[image_to_base64(url) for url in product_image_urls])
 
-    # Combine all images
-    all_images = [user_image] + product_images_base64
+async def prepare_generation(context, user_image: str, product_image_urls: List[str], tier: Optional[str] = None,
+                             renders: Optional[List[Optional[str]]] = None) -> PreparedGeneration:
+    # Prompt writing plus every render, each at its route's image quality, checked
+    # against the session's token budget. renders lists the tier of each render
+    # the caller will run; by default one at the requested tier
+    render_tokens = sum(
+        generated_image_tokens(model_router.select("image_generation", render_tier, record=False))
+        for render_tier in (renders or [tier])
+    )
+    context, tier = apply_session_budget(
+        context, tier,
+        estimate_request_tokens(
+            context, DESIGN_AGENT_IMG_SYS_PROMPT,
+            image_tokens=resize_profile(ROOM).image_tokens() + len(product_image_urls) * resize_profile(PRODUCT).image_tokens()
+        )
+        + render_tokens
+    )
 
-    # Resize all images
-    resized_images = await resize_all_images(all_images)
+    # Fetch the product images; the resize reads the bytes directly
+    product_images = await asyncio.gather(*[fetch_image(url) for url in product_image_urls])
 
-    # Construct user content with input_image format
-    user_content = [
-        {
-            "type": "input_image",
-            "image_url": f"data:image/png;base64,{image_base64}"
-        } for image_base64 in resized_images
-    ]
-
-    # Send API request
-    response = client.responses.create(
-        model="gpt-4.1-mini",
-        input=[
-            {
-                "role": "system",
-                "content": DESIGN_AGENT_IMG_SYS_PROMPT
-            }] + context +
-            [{
-                "role": "user",
-                "content": user_content
-            }
-        ]
+    # Resize the room at full reference fidelity, products and earlier conversation images smaller
+    room_image, product_images, context = await asyncio.gather(
+        reference_resize_base64(user_image, ROOM),
+        resize_all_images(product_images, PRODUCT),
+        prepare_context(context)
     )
+    details = [resize_profile(ROOM).detail] + [resize_profile(PRODUCT).detail] * len(product_images)
+    return PreparedGeneration([room_image] + product_images, context, model_router.select("image_prompt", tier), tier, details)
 
-    prompt =  (response.output[0].content[0].text).split("Product list:")[0].strip() + "(Keep geometry, composition, and lcoation of objects exactly same as image1). (Keep windows, doors, ceiling, floors, and everything else exactly the same as image1)"
 
-    # Send API request
-    response = client.responses.create(
-        model="gpt-4.1",
+async def build_generation_prompt(prepared: PreparedGeneration) -> str:
+    """Write the image prompt for a prepared generation, once per request."""
+    async with prepared.prompt_lock:
+        if prepared.prompt is not None:
+            return prepared.prompt
+
+        # Send API request
+        response = await create_routed_response(
+            prepared.prompt_route,
+            input=[
+                {
+                    "role": "system",
+                    "content": DESIGN_AGENT_IMG_SYS_PROMPT
+                }] + prepared.context +
+                [{
+                    "role": "user",
+                    "content": prepared.user_content
+                }
+            ]
+        )
+
+        prepared.prompt = (response.output[0].content[0].text).split("Product list:")[0].strip() + "(Keep geometry, composition, and lcoation of objects exactly same as image1). (Keep windows, doors, ceiling, floors, and everything else exactly the same as image1)"
+        return prepared.prompt
+
+
+async def render_design(prepared: PreparedGeneration, image_route, regenerate: bool = False, on_partial_image=None, variant: int = 0) -> str:
+    """
+    Render one design image from prepared inputs, through the generation cache.
+
+    Args:
+        prepared (PreparedGeneration): Output of prepare_generation
+        image_route (OpenAIConfig): Route for the image_generation call
+        regenerate (bool): Skip the cache lookup
+        on_partial_image (callable): If given, the render is streamed and this
+            is called with (index, base64) for each partial image, on a worker thread
+        variant (int): Alternative render number; each variant is cached separately
+
+    Returns:
+        str: Base64 image, or None if the model returned no image
+    """
+    cache_key = prepared.cache_key(image_route, variant)
+    if not regenerate:
+        cached_image = await generation_cache.get(cache_key)
+        if cached_image is not None:
+            logger.info("Returning cached design")
+            return cached_image
+
+    prompt = await build_generation_prompt(prepared)
+
+    # Design knowledge: retrieved locally when the knowledge base is present,
+    # otherwise left to the remote file_search tool
+    image_tool = image_route.image_generation_tool()
+    tools = [image_tool]
+    if knowledge_retriever.available:
+        passages = knowledge_retriever.retrieve(prompt)
+        if passages:
+            prompt += "\n\nDesign reference notes:\n" + "\n---\n".join(passages)
+    else:
+        tools.insert(0, {
+            "type": "file_search",
+            "vector_store_ids": [retrieval_config.fallback_vector_store_id]
+        })
+
+    request = dict(
         input=[
             {
                 "role": "user",
@@ -254,27 +443,130 @@ async def design_assistant_image_generation(context, user_image: str, product_im
             },
             {
                 "role": "user",
-                "content": user_content
+                "content": prepared.user_content
             }
         ],
-        tools=[
-            {
-                "type": "file_search",
-                "vector_store_ids": ["vs_684752e9fc008191a0a8e3acc7642b9a"]
-            },
-            {
-                "type": "image_generation",
-                "size": "auto",
-                "quality": "medium"
-            }
-        ]
+        tools=tools
     )
 
+    # Send API request
+    if on_partial_image is None:
+        response = await create_routed_response(image_route, **request)
+    else:
+        image_tool["partial_images"] = PARTIAL_IMAGES
+
+        def on_event(event):
+            if event.type == "response.image_generation_call.partial_image":
+                on_partial_image(event.partial_image_index, event.partial_image_b64)
+
+        response = await stream_routed_response(image_route, on_event, **request)
+
     # Extract image result
     base64_image = None
-    for item in response.output:
+    for item in (response.output if response else []):
         if item.type == "image_generation_call" and item.result:
             base64_image = item.result
             break
 
-    return base64_image
\ No newline at end of file
+    if base64_image:
+        await generation_cache.put(cache_key, base64_image)
+
+    return base64_image
+
+
+# Your main function that handles image conversion and resizing
+async def design_assistant_image_generation(context, user_image: str, product_image_urls: List[str], regenerate: bool = False, tier: Optional[str] = None) -> str:
+    prepared = await prepare_generation(context, user_image, product_image_urls, tier)
+    return await render_design(prepared, model_router.select("image_generation", prepared.tier), regenerate)
+
+
+async def generate_design_variants(context, user_image: str, product_image_urls: List[str], variants: int, regenerate: bool = False, tier: Optional[str] = None):
+    """
+    Render several alternative designs from one set of prepared inputs.
+
+    Images are fetched and resized and the prompt is written once. The renders
+    then run concurrently, at most VARIANT_MAX_CONCURRENCY at a time.
+
+    Yields:
+        dict: {"type": "variant", "index": i, "image": base64} as each render finishes
+    """
+    variants = max(1, min(variants, concurrency_config.max_variants))
+    prepared = await prepare_generation(context, user_image, product_image_urls, tier, [tier] * variants)
+    image_route = model_router.select("image_generation", prepared.tier)
+
+    # A repeat whose variants are all cached needs no prompt call at all
+    cached = {}
+    if not regenerate:
+        images = await asyncio.gather(*[generation_cache.get(prepared.cache_key(image_route, index)) for index in range(variants)])
+        cached = {index: image for index, image in enumerate(images) if image is not None}
+    if len(cached) < variants:
+        # Write the prompt before fanning out so every variant shares it
+        await build_generation_prompt(prepared)
+
+    semaphore = asyncio.Semaphore(concurrency_config.variant_limit)
+
+    async def render_variant(index):
+        if index in cached:
+            return {"type": "variant", "index": index, "image": cached[index]}
+        async with semaphore:
+            # Already looked up above; skip the cache on the render itself
+            image = await render_design(prepared, image_route, True, variant=index)
+            return {"type": "variant", "index": index, "image": image}
+
+    tasks = [asyncio.ensure_future(render_variant(index)) for index in range(variants)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def progressive_image_generation(context, user_image: str, product_image_urls: List[str], regenerate: bool = False, is_disconnected=None):
+    """
+    Render a cheap preview first, then the final design from the same inputs.
+
+    The final render streams partial images as the model produces them. It is
+    only started if the client is still connected after the preview.
+
+    Args:
+        is_disconnected (callable): Async callable returning True once the client has gone
+
+    Yields:
+        dict: {"type": "preview" | "partial" | "final", "image": base64, ...}
+    """
+    prepared = await prepare_generation(context, user_image, product_image_urls, renders=[PREVIEW, FINAL])
+
+    preview_image = await render_design(prepared, model_router.select("image_generation", PREVIEW), regenerate)
+    yield {"type": "preview", "image": preview_image}
+
+    if prepared.tier == PREVIEW:
+        # Session is near its token budget; the preview is the final design
+        metrics.increment("progressive.final_skipped")
+        yield {"type": "final", "image": preview_image}
+        return
+
+    if is_disconnected is not None and await is_disconnected():
+        context = current_request()
+        if context is not None:
+            context.cancel("disconnect")
+        metrics.increment("progressive.final_skipped")
+        metrics.increment("cancellation.skipped.image_generation")
+        logger.info("Client left after the preview, skipping the final render")
+        return
+
+    loop = asyncio.get_running_loop()
+    partials = asyncio.Queue()
+
+    def on_partial_image(index, image):
+        loop.call_soon_threadsafe(partials.put_nowait, {"type": "partial", "index": index, "image": image})
+
+    final_task = asyncio.ensure_future(
+        render_design(prepared, model_router.select("image_generation", FINAL), regenerate, on_partial_image)
+    )
+    try:
+        async for partial in drain_events(final_task, partials):
+            yield partial
+        yield {"type": "final", "image": final_task.result()}
+    finally:
+        final_task.cancel()
@@ -0,0 +1,169 @@
+import asyncio
+import secrets
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from fast_api_server.services.design_agent_service import design_assistant, generate_design_variants, progressive_image_generation
+from fast_api_server.services.image_utils import CHAT, ROOM, reference_resize_base64, resize_profile
+from fast_api_server.utils.config import design_session_config
+from fast_api_server.utils.metrics import metrics
+from fast_api_server.utils.streaming import drain_events
+
+
+class DesignSession:
+    """
+    Conversation state of one design session, kept server-side so a client
+    only sends each new turn. Images are stored already resized.
+    """
+    def __init__(self, session_id: str, owner: Optional[str] = None):
+        self.session_id = session_id
+        # Client key of the connection that created the session
+        self.owner = owner
+        self.context: List[Dict] = []
+        self.room_image: Optional[str] = None
+        self.products: List[Dict] = []
+        self.turns = 0
+        self.last_active = time.monotonic()
+        # One turn at a time, even with several sockets on the same session
+        self.lock = asyncio.Lock()
+
+    def summary(self) -> Dict:
+        return {
+            "type": "session",
+            "session_id": self.session_id,
+            "turns": self.turns,
+            "messages": len(self.context),
+            "has_room_image": self.room_image is not None,
+            "products": self.products,
+        }
+
+    async def set_room_image(self, image: str) -> str:
+        self.room_image = await reference_resize_base64(image, ROOM)
+        return self.room_image
+
+    def product_image_urls(self, product_ids: List[int]) -> List[str]:
+        """Top shopping thumbnail of each product from the last chat turn, by product id."""
+        urls = []
+        for product in self.products:
+            if product["id"] not in product_ids:
+                continue
+            results = product.get("shopping_search", {}).get("shopping_results", [])
+            thumbnail = next((item["thumbnail"] for item in results if item.get("thumbnail")), None)
+            if thumbnail is None:
+                raise ValueError(f"No product image for product {product['id']}")
+            urls.append(thumbnail)
+        return urls
+
+    async def chat(self, user_prompt: str, user_image: Optional[str] = None, tier: Optional[str] = None):
+        """
+        Run one chat turn against the stored context.
+
+        Yields:
+            dict: "token" events as the reply streams, a "product" event per
+            finished search, then "message" and "products" for the whole turn
+        """
+        # The room photo keeps generation fidelity; the stored turn gets the smaller chat copy
+        resized_image = None
+        if user_image:
+            _, resized_image = await asyncio.gather(self.set_room_image(user_image), reference_resize_base64(user_image, CHAT))
+
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+
+        def push(event):
+            loop.call_soon_threadsafe(events.put_nowait, event)
+
+        turn = asyncio.ensure_future(design_assistant(
+            self.context, user_prompt, user_image, tier=tier,
+            on_text_delta=lambda delta: push({"type": "token", "text": delta}),
+            on_product=lambda product: push({"type": "product", "product": product}),
+        ))
+        try:
+            async for event in drain_events(turn, events):
+                yield event
+            result = turn.result()
+        finally:
+            turn.cancel()
+
+        user_content = [{"type": "input_text", "text": user_prompt}]
+        if resized_image:
+            user_content.append({
+                "type": "input_image",
+                "image_url": f"data:image/jpeg;base64,{resized_image}",
+                "detail": resize_profile(CHAT).detail
+            })
+        reply = result["conversation"][0]
+        self.context += [{"role": "user", "content": user_content}, {"role": reply["role"], "content": reply["content"]}]
+        self.products = result["products"]
+        self.turns += 1
+
+        yield {"type": "message", "role": reply["role"], "content": reply["content"]}
+        yield {"type": "products", "products": self.products, "products_found": result["products_found"]}
+
+    async def generate(self, product_image_urls: List[str], variants: int = 1, regenerate: bool = False,
+                       tier: Optional[str] = None, is_disconnected=None):
+        """
+        Render a design of the room image with the chosen products.
+
+        Yields:
+            dict: "variant" events when variants > 1, otherwise the progressive
+            "preview", "partial" and "final" events
+        """
+        if self.room_image is None:
+            raise ValueError("Send a room image before generating a design")
+        if variants > 1:
+            events = generate_design_variants(self.context, self.room_image, product_image_urls, variants, regenerate, tier)
+        else:
+            events = progressive_image_generation(self.context, self.room_image, product_image_urls, regenerate, is_disconnected)
+        async for event in events:
+            yield event
+
+
+class DesignSessionStore:
+    """In-process sessions, least recently active dropped past DESIGN_SESSION_MAX or after the idle TTL."""
+    def __init__(self, config=design_session_config):
+        self.config = config
+        self._sessions = OrderedDict()
+
+    def get_or_create(self, session_id: Optional[str] = None, owner: Optional[str] = None) -> DesignSession:
+        """
+        Resume the session with this id, or start a new one with a server-issued id.
+
+        Raises:
+            PermissionError: The session was created by another client
+        """
+        self._expire()
+        session = self._sessions.get(session_id) if session_id else None
+        if session is not None and session.owner != owner:
+            metrics.increment("design_session.forbidden")
+            raise PermissionError("Session belongs to another client")
+        if session is None:
+            # Ids are never taken from the client, so they cannot be guessed or chosen
+            session = DesignSession(secrets.token_urlsafe(24), owner)
+            metrics.increment("design_session.created")
+        else:
+            self._sessions.move_to_end(session.session_id)
+        session.last_active = time.monotonic()
+        self._sessions[session.session_id] = session
+        while len(self._sessions) > self.config.max_sessions:
+            self._sessions.popitem(last=False)
+            metrics.increment("design_session.evicted")
+        metrics.set_gauge("design_session.active", len(self._sessions))
+        return session
+
+    def touch(self, session: DesignSession):
+        session.last_active = time.monotonic()
+        if session.session_id in self._sessions:
+            self._sessions.move_to_end(session.session_id)
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.config.idle_ttl_s
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.last_active >= cutoff:
+                break
+            self._sessions.popitem(last=False)
+            metrics.increment("design_session.expired")
+
+
+design_sessions = DesignSessionStore()
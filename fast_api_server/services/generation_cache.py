@@ -0,0 +1,145 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Dict, List, Optional
+from fast_api_server.services.image_utils import ImageCache, image_content_hash
+from fast_api_server.utils.config import generation_cache_config
+from fast_api_server.utils.logger import logger
+from fast_api_server.utils.metrics import metrics
+
+
+def normalize_content(content):
+    """
+    Reduce message content to what affects the generated design: collapsed
+    whitespace for text, a content hash for images.
+    """
+    if isinstance(content, str):
+        return re.sub(r"\s+", " ", content).strip()
+    normalized = []
+    for part in content or []:
+        if part.get("type") == "input_image" and isinstance(part.get("image_url"), str):
+            normalized.append({"type": "input_image", "hash": image_content_hash(part["image_url"])})
+        elif "text" in part:
+            normalized.append({"type": part.get("type"), "text": normalize_content(part["text"])})
+        else:
+            normalized.append(part)
+    return normalized
+
+
+def generation_cache_key(resized_images: List[str], context: List[Dict], settings: Optional[Dict] = None) -> str:
+    """
+    Content hash of everything that determines a generated design.
+
+    Args:
+        resized_images (list): Resized room and product images, in prompt order
+        context (list): Prepared conversation context (message dicts)
+        settings (dict): Model / image settings the design is rendered with
+
+    Returns:
+        str: Hex digest used as the cache key
+    """
+    payload = {
+        "images": [image_content_hash(image) for image in resized_images],
+        "context": [
+            {"role": message.get("role"), "content": normalize_content(message.get("content"))}
+            for message in context
+        ],
+        "settings": settings or {},
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    """
+    Directory of base64 files with a total byte budget.
+
+    Least recently used files (by mtime, refreshed on every hit) are removed
+    once the budget is exceeded.
+    """
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.b64")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = f.read()
+            os.utime(path)
+            return value
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = self._path(key) + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(value)
+            os.replace(tmp_path, self._path(key))
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".b64"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+class GenerationCache:
+    """Two-tier (memory LRU, then disk) cache of generated design images."""
+    def __init__(self, config=generation_cache_config):
+        self.memory = ImageCache(config.memory_max_bytes)
+        self.disk = DiskCache(config.disk_dir, config.disk_max_bytes)
+
+    async def get(self, key) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is not None:
+            metrics.increment("generation_cache.memory_hits")
+            return value
+
+        loop = asyncio.get_running_loop()
+        try:
+            value = await loop.run_in_executor(None, self.disk.get, key)
+        except OSError as e:
+            logger.error(f"Generation cache read failed: {str(e)}")
+            value = None
+        if value is not None:
+            metrics.increment("generation_cache.disk_hits")
+            self.memory.put(key, value)
+            return value
+
+        metrics.increment("generation_cache.misses")
+        return None
+
+    async def put(self, key, value):
+        self.memory.put(key, value)
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self.disk.put, key, value)
+        except OSError as e:
+            logger.error(f"Generation cache write failed: {str(e)}")
+
+
+generation_cache = GenerationCache()
@@ -1,108 +1,281 @@
-from typing import List, Optional
-import numpy as np
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Union
 from io import BytesIO
 import base64
-from PIL import Image
+from fast_api_server.utils.concurrency import get_executor
+from fast_api_server.utils.config import ResizeProfile, concurrency_config, image_config
+from fast_api_server.utils.http_client import get_http_session
+from fast_api_server.utils.logger import logger
+from fast_api_server.utils.metrics import metrics
+from fast_api_server.utils.request_context import checkpoint
+from fast_api_server.utils.request_limits import check_decoded_pixels
 
 
-async def reference_resize_base64(image_base64):
+class ImageCache:
     """
-    Resize a base64 encoded image to 512x512 resolution using outer fit method.
+    Byte-bounded LRU cache of base64 strings (or raw image bytes) keyed by content hash.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        # Written from worker threads (prefetch) as well as the event loop
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self.current_bytes -= len(self._items.pop(key))
+            self._items[key] = value
+            self.current_bytes += len(value)
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.current_bytes -= len(evicted)
+
+
+# Resize profiles, see ImageConfig.resize_profiles
+ROOM = "room"
+PRODUCT = "product"
+CHAT = "chat"
+
+_resize_profiles = {
+    name: ResizeProfile(name, **settings) for name, settings in image_config.resize_profiles.items()
+}
+
+
+def resize_profile(name: str) -> ResizeProfile:
+    profile = _resize_profiles.get(name)
+    if profile is None:
+        raise ValueError(f"Unknown resize profile: {name}")
+    return profile
+
+
+resize_cache = ImageCache(image_config.resize_cache_max_bytes)
+# Downloaded product images as raw bytes, keyed by URL
+fetch_cache = ImageCache(image_config.fetch_cache_max_bytes)
+
+
+def strip_data_url(image_base64):
+    """Return the bare base64 payload of a data URL or base64 string."""
+    if image_base64.startswith('data:'):
+        return image_base64.split(',', 1)[1]
+    return image_base64
+
+
+def image_content_hash(image_base64):
+    """SHA-256 of the base64 payload, ignoring any data URL prefix, or of raw image bytes."""
+    if isinstance(image_base64, bytes):
+        return hashlib.sha256(image_base64).hexdigest()
+    return hashlib.sha256(strip_data_url(image_base64).encode('utf-8')).hexdigest()
+
+
+def resize_cache_key(image_base64, profile: str):
+    return f"{profile}:{image_content_hash(image_base64)}"
+
+
+# Sync function to fetch an image; kept as bytes so the resize needn't decode it again
+def sync_fetch_image(url: str, timeout: Optional[float] = None) -> bytes:
+    response = get_http_session().get(url, timeout=timeout)
+    if response.status_code != 200:
+        raise Exception(f"Failed to fetch image from {url}")
+    return response.content
+
+
+def resize_executor():
+    """Thread pool that bounds how many images are resized at once."""
+    return get_executor("resize", concurrency_config.resize_workers)
+
+
+def warm_up_resize():
+    """
+    Import the imaging libraries and start every resize worker thread, so the
+    first real request doesn't pay for either.
+    """
+    import numpy  # noqa: F401
+    from PIL import Image
+
+    buffered = BytesIO()
+    # Larger than the default profiles, so the sample is actually resized
+    Image.new('RGB', (1280, 1280)).save(buffered, format='PNG')
+    sample = base64.b64encode(buffered.getvalue()).decode('utf-8')
+
+    # One task per worker; each holds its thread briefly so the pool spawns them all
+    barrier = threading.Barrier(concurrency_config.resize_workers, timeout=5)
+
+    def touch():
+        sync_reference_resize_base64(sample)
+        try:
+            barrier.wait()
+        except threading.BrokenBarrierError:
+            pass
+
+    futures = [resize_executor().submit(touch) for _ in range(concurrency_config.resize_workers)]
+    for future in futures:
+        future.result()
+
+
+async def reference_resize_base64(image_base64, profile: str = ROOM):
+    """
+    Resize a base64 encoded image on the resize worker pool, reusing the
+    cached result when the same image has been resized for the same profile.
+
+    Args:
+        image_base64: Base64 encoded string of the image, or its raw bytes
+        profile (str): Resize profile of the stage the image is for
+
+    Returns:
+        Base64 encoded string of the resized image
+    """
+    key = resize_cache_key(image_base64, profile)
+    cached = resize_cache.get(key)
+    if cached is not None:
+        return cached
+
+    checkpoint("resize")
+    loop = asyncio.get_running_loop()
+    with metrics.timer(f"resize.{profile}"):
+        resized = await loop.run_in_executor(resize_executor(), sync_reference_resize_base64, image_base64, profile)
+    resize_cache.put(key, resized)
+    return resized
+
+
+def sync_reference_resize_base64(image_base64, profile: str = ROOM):
+    """
+    Resize a base64 encoded image for one stage of the pipeline.
+
+    The long edge is brought down to the profile's max_side, keeping the
+    aspect ratio. Images already small enough are returned unchanged unless
+    the profile upscales or pads to a square canvas (filled with the median
+    border colour).
     
     Args:
-        image_base64: Base64 encoded string of the image
+        image_base64: Base64 encoded string of the image, or its raw bytes
+            (e.g. a fetched product image)
+        profile (str): Resize profile name, see ImageConfig.resize_profiles
         
     Returns:
         Base64 encoded string of the resized image
     """
+    # Imported lazily to keep worker boot fast; warm_up_resize loads them at startup
+    import numpy as np
+    from PIL import Image
+
+    settings = resize_profile(profile)
+
     # Decode base64 to binary data
-    if image_base64.startswith('data:image'):
-        # Remove data URL prefix if present
-        image_base64 = image_base64.split(',', 1)[1]
-    
-    image_data = base64.b64decode(image_base64)
+    if isinstance(image_base64, bytes):
+        image_data = image_base64
+    else:
+        image_base64 = strip_data_url(image_base64)
+        image_data = base64.b64decode(image_base64)
     
-    # Convert binary data to PIL Image
+    # Convert binary data to PIL Image (reads the header only)
     image_pil = Image.open(BytesIO(image_data))
     
-    # Get original dimensions
+    # Get original dimensions, and refuse huge images before decoding them
     original_width, original_height = image_pil.size
+    check_decoded_pixels(original_width, original_height)
     
-    # Set fixed target dimensions to 512x512
-    target_width, target_height = 512, 512
-    
-    # Calculate the scaling factor to maintain aspect ratio
-    scale = min(target_width / original_width, target_height / original_height)
-    new_width = int(original_width * scale)
-    new_height = int(original_height * scale)
-    
+    # Scale to fit the profile, never enlarging unless it asks to
+    new_width, new_height = settings.target_size(original_width, original_height)
+    if settings.canvas:
+        target_width = target_height = settings.max_side
+    else:
+        target_width, target_height = new_width, new_height
+
+    metrics.observe(f"resize.{profile}.image_tokens", settings.image_tokens(target_width, target_height))
+
+    # Nothing to do: send the original bytes rather than re-encode them
+    if (target_width, target_height) == (original_width, original_height):
+        metrics.increment(f"resize.{profile}.unchanged")
+        if isinstance(image_base64, bytes):
+            image_base64 = base64.b64encode(image_data).decode('ascii')
+        metrics.observe(f"resize.{profile}.output_bytes", len(image_base64))
+        return image_base64
+
     # Resize the image while preserving aspect ratio
     # Using LANCZOS for better quality
     resized_image = image_pil.resize((new_width, new_height), Image.LANCZOS)
-    
-    # Create a new image with the target dimensions
-    # Sample the border pixels to determine background color
-    img_array = np.array(image_pil)
-    border_color = None
-    
-    if len(img_array.shape) == 3:  # RGB or RGBA
-        # Calculate border color from edges
-        edges = []
-        
-        # Top and bottom rows
-        if img_array.shape[0] > 0:
-            edges.append(img_array[0])
-            edges.append(img_array[-1])
-        
-        # Left and right columns
-        if img_array.shape[1] > 0 and img_array.shape[0] > 2:
-            edges.append(img_array[1:-1, 0])
-            edges.append(img_array[1:-1, -1])
+    final_image = resized_image
+
+    if settings.canvas:
+        # Create a new image with the target dimensions
+        # Sample the border pixels to determine background color, copying only
+        # the one-pixel edges rather than the whole image into numpy
+        border_color = None
         
-        if edges:
+        if len(image_pil.getbands()) > 1:  # RGB or RGBA
+            # Calculate border color from edges
+            bands = len(image_pil.getbands())
+            edges = []
+            
+            # Top and bottom rows
+            edges.append(np.asarray(image_pil.crop((0, 0, original_width, 1))).reshape(-1, bands))
+            edges.append(np.asarray(image_pil.crop((0, original_height - 1, original_width, original_height))).reshape(-1, bands))
+            
+            # Left and right columns
+            if original_height > 2:
+                edges.append(np.asarray(image_pil.crop((0, 1, 1, original_height - 1))).reshape(-1, bands))
+                edges.append(np.asarray(image_pil.crop((original_width - 1, 1, original_width, original_height - 1))).reshape(-1, bands))
+            
             # Flatten the edges and calculate median color
             edges_flat = np.vstack(edges)
             border_color = tuple(map(int, np.median(edges_flat, axis=0)))
-    
-    # Default to light gray if calculation fails
-    if not border_color:
+        
+        # Default to light gray if calculation fails
+        if not border_color:
+            if image_pil.mode == 'RGBA':
+                border_color = (240, 240, 240, 255)  # Light gray with full opacity
+            else:
+                border_color = (240, 240, 240)  # Light gray
+        
+        # Create the final image with background color
+        final_image = Image.new(image_pil.mode, (target_width, target_height), border_color)
+        
+        # Calculate position to paste the resized image (centered)
+        paste_x = (target_width - new_width) // 2
+        paste_y = (target_height - new_height) // 2
+        
+        # Paste the resized image onto the background
         if image_pil.mode == 'RGBA':
-            border_color = (240, 240, 240, 255)  # Light gray with full opacity
+            final_image.paste(resized_image, (paste_x, paste_y), resized_image)
         else:
-            border_color = (240, 240, 240)  # Light gray
+            final_image.paste(resized_image, (paste_x, paste_y))
     
-    # Create the final image with background color
-    final_image = Image.new(image_pil.mode, (target_width, target_height), border_color)
-    
-    # Calculate position to paste the resized image (centered)
-    paste_x = (target_width - new_width) // 2
-    paste_y = (target_height - new_height) // 2
-    
-    # Paste the resized image onto the background
-    if image_pil.mode == 'RGBA':
-        final_image.paste(resized_image, (paste_x, paste_y), resized_image)
-    else:
-        final_image.paste(resized_image, (paste_x, paste_y))
-    
-    # Convert the resized image back to base64
-    buffered = BytesIO()
     # Preserve original format if possible, otherwise default to PNG
     format = image_pil.format if image_pil.format else 'PNG'
-    final_image.save(buffered, format=format)
-    img_str = base64.b64encode(buffered.getvalue())
+    # Drop the decoded source before encoding the output
+    del image_pil, resized_image, image_data
     
-    # Return as base64 string
-    return img_str.decode('utf-8')
+    # Convert the resized image back to base64, encoding straight from the buffer
+    buffered = BytesIO()
+    final_image.save(buffered, format=format)
+    resized_base64 = base64.b64encode(buffered.getbuffer()).decode('ascii')
+    metrics.observe(f"resize.{profile}.output_bytes", len(resized_base64))
+    return resized_base64
 
 
-async def resize_all_images(reference_images: Optional[List[str]] = None) -> List[str]:
+async def resize_all_images(reference_images: Optional[List[Union[str, bytes]]] = None, profile: str = ROOM) -> List[str]:
     if not reference_images:
         return []
 
-    resized_images = []
-    for image in reference_images:
-        print(f"Processing input images....")
-        resized_image = await reference_resize_base64(image)
-        resized_images.append(resized_image)
-    print(f"Image processing successful....")
-    return resized_images
\ No newline at end of file
+    logger.debug(f"Resizing {len(reference_images)} images ({profile})")
+    resized_images = await asyncio.gather(*[reference_resize_base64(image, profile) for image in reference_images])
+    return list(resized_images)
@@ -0,0 +1,139 @@
+import json
+import os
+import threading
+from fast_api_server.services.usage import usage_tracker
+from fast_api_server.utils.config import OpenAIConfig
+from fast_api_server.utils.logger import logger
+from fast_api_server.utils.metrics import metrics
+from fast_api_server.utils.openai_client import create_response, stream_response
+from fast_api_server.utils.request_context import checkpoint, stage_timeout
+
+PREVIEW = "preview"
+FINAL = "final"
+
+# Endpoint -> tier -> settings. Overridden per key by MODEL_ROUTES_PATH / MODEL_ROUTES.
+DEFAULT_ROUTES = {
+    "design_agent": {
+        FINAL: {"model": "gpt-4.1-mini", "max_tokens": 2000, "timeout_ms": 60000, "min_budget_ms": 3000},
+        PREVIEW: {"model": "gpt-4.1-nano", "max_tokens": 1200, "timeout_ms": 30000, "min_budget_ms": 2000},
+    },
+    "image_prompt": {
+        FINAL: {"model": "gpt-4.1-mini", "max_tokens": 2000, "timeout_ms": 60000, "min_budget_ms": 3000},
+        PREVIEW: {"model": "gpt-4.1-mini", "max_tokens": 1200, "timeout_ms": 30000, "min_budget_ms": 2000},
+    },
+    "image_generation": {
+        FINAL: {"model": "gpt-4.1", "max_tokens": None, "timeout_ms": 240000, "min_budget_ms": 20000,
+                "image_quality": "medium", "image_size": "auto"},
+        PREVIEW: {"model": "gpt-4.1-mini", "max_tokens": None, "timeout_ms": 120000, "min_budget_ms": 8000,
+                  "image_quality": "low", "image_size": "1024x1024"},
+    },
+}
+
+
+class ModelRouter:
+    """
+    Picks model, output-token cap and image settings per endpoint and tier.
+
+    Routes start from DEFAULT_ROUTES, then the JSON file at MODEL_ROUTES_PATH
+    (re-read whenever it changes, so routes can be switched without a
+    redeploy), then the MODEL_ROUTES environment variable. DEFAULT_TIER sets
+    the tier for requests that don't ask for one.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = None
+        self._loaded_mtime = None
+
+    def _load(self):
+        routes = {endpoint: {tier: dict(settings) for tier, settings in tiers.items()}
+                  for endpoint, tiers in DEFAULT_ROUTES.items()}
+        overrides = []
+        path = os.getenv("MODEL_ROUTES_PATH")
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                overrides.append(json.load(f))
+        if os.getenv("MODEL_ROUTES"):
+            overrides.append(json.loads(os.getenv("MODEL_ROUTES")))
+        for override in overrides:
+            for endpoint, tiers in override.items():
+                for tier, settings in tiers.items():
+                    routes.setdefault(endpoint, {}).setdefault(tier, {}).update(settings)
+        return routes
+
+    def _current_mtime(self):
+        path = os.getenv("MODEL_ROUTES_PATH")
+        if path and os.path.exists(path):
+            return os.path.getmtime(path)
+        return None
+
+    def routes(self):
+        mtime = self._current_mtime()
+        with self._lock:
+            if self._routes is None or mtime != self._loaded_mtime:
+                try:
+                    self._routes = self._load()
+                    self._loaded_mtime = mtime
+                    logger.info("Loaded model routes")
+                except (OSError, ValueError) as e:
+                    logger.error(f"Could not load model routes, keeping previous: {str(e)}")
+                    if self._routes is None:
+                        self._routes = DEFAULT_ROUTES
+            return self._routes
+
+    def select(self, endpoint, tier=None, record=True) -> OpenAIConfig:
+        """
+        Args:
+            endpoint (str): "design_agent", "image_prompt" or "image_generation"
+            tier (str): "preview" or "final"; defaults to DEFAULT_TIER, then "final"
+            record (bool): Count the choice in routing metrics; off when only estimating
+
+        Returns:
+            OpenAIConfig: Settings for the call
+        """
+        tier = tier or os.getenv("DEFAULT_TIER") or FINAL
+        tiers = self.routes()[endpoint]
+        if tier not in tiers:
+            tier = FINAL
+        route = OpenAIConfig(**tiers[tier])
+        route.endpoint = endpoint
+        route.tier = tier
+        if record:
+            metrics.increment(f"routing.{endpoint}.{tier}.{route.model}")
+        return route
+
+
+model_router = ModelRouter()
+
+
+def routed_kwargs(route: OpenAIConfig):
+    """
+    Call arguments for a route, with the timeout cut to what is left of the
+    request deadline. Raises if the request is gone or too short on time.
+    """
+    checkpoint(route.endpoint, route.min_budget_ms / 1000)
+    kwargs = route.response_kwargs()
+    kwargs["timeout"] = stage_timeout(kwargs.get("timeout"))
+    if kwargs["timeout"] is None:
+        del kwargs["timeout"]
+    return kwargs
+
+
+async def create_routed_response(route: OpenAIConfig, **kwargs):
+    """
+    Call OpenAI with the settings of a route and record the latency under
+    routing.<endpoint>.<tier>.
+    """
+    call_kwargs = routed_kwargs(route)
+    with metrics.timer(f"routing.{route.endpoint}.{route.tier}"):
+        response = await create_response(**call_kwargs, **kwargs)
+    usage_tracker.record(route, response)
+    return response
+
+
+async def stream_routed_response(route: OpenAIConfig, on_event, **kwargs):
+    """Streaming variant of create_routed_response, see stream_response."""
+    call_kwargs = routed_kwargs(route)
+    with metrics.timer(f"routing.{route.endpoint}.{route.tier}"):
+        response = await stream_response(on_event, **call_kwargs, **kwargs)
+    usage_tracker.record(route, response)
+    return response
@@ -0,0 +1,80 @@
+import asyncio
+from typing import Dict, List
+from fast_api_server.services.image_utils import (
+    PRODUCT,
+    fetch_cache,
+    resize_cache,
+    resize_cache_key,
+    sync_fetch_image,
+    sync_reference_resize_base64,
+)
+from fast_api_server.utils.concurrency import get_executor
+from fast_api_server.utils.config import image_config
+from fast_api_server.utils.logger import logger
+from fast_api_server.utils.metrics import metrics
+
+PREFETCH_TIMEOUT_S = 10
+
+
+class Prefetcher:
+    """
+    Background fetch-and-resize of product thumbnails from shopping search.
+
+    Runs on its own small thread pool, so it never takes image fetch slots
+    or resize workers from live requests, and drops work rather than queue
+    past PREFETCH_MAX_PENDING. Results land in fetch_cache and resize_cache,
+    where /generate-image finds them.
+    """
+    def __init__(self, config=image_config):
+        self.config = config
+        self._pending = set()
+        self._tasks = set()
+
+    def schedule_products(self, products: List[Dict]):
+        """Queue the top-ranked thumbnails of each product from search_all_products."""
+        urls = []
+        for product in products:
+            results = product.get("shopping_search", {}).get("shopping_results", [])
+            for item in results[:self.config.prefetch_per_product]:
+                if item.get("thumbnail"):
+                    urls.append(item["thumbnail"])
+        self.schedule(urls)
+
+    def schedule(self, urls: List[str]):
+        if self.config.prefetch_workers <= 0:
+            return
+        for url in urls:
+            if url in self._pending or fetch_cache.get(url) is not None:
+                continue
+            if len(self._pending) >= self.config.prefetch_max_pending:
+                metrics.increment("prefetch.dropped")
+                continue
+            self._pending.add(url)
+            metrics.increment("prefetch.scheduled")
+            task = asyncio.ensure_future(self._prefetch(url))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _prefetch(self, url: str):
+        loop = asyncio.get_running_loop()
+        executor = get_executor("prefetch", self.config.prefetch_workers)
+        try:
+            await loop.run_in_executor(executor, self._fetch_and_resize, url)
+            metrics.increment("prefetch.completed")
+        except Exception as e:
+            metrics.increment("prefetch.failed")
+            logger.debug(f"Prefetch of {url} failed: {str(e)}")
+        finally:
+            self._pending.discard(url)
+
+    def _fetch_and_resize(self, url: str):
+        image = fetch_cache.get(url)
+        if image is None:
+            image = sync_fetch_image(url, PREFETCH_TIMEOUT_S)
+            fetch_cache.put(url, image)
+        key = resize_cache_key(image, PRODUCT)
+        if resize_cache.get(key) is None:
+            resize_cache.put(key, sync_reference_resize_base64(image, PRODUCT))
+
+
+prefetcher = Prefetcher()
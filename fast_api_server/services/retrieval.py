@@ -0,0 +1,148 @@
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import List
+from fast_api_server.utils.config import retrieval_config
+from fast_api_server.utils.logger import logger
+from fast_api_server.utils.metrics import metrics
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "into", "is", "it",
+    "of", "on", "or", "the", "to", "with", "add", "step", "image1", "image", "same", "keep",
+}
+INDEXED_EXTENSIONS = (".txt", ".md")
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def split_passages(text: str, max_chars: int) -> List[str]:
+    """
+    Split a document on blank lines, merging consecutive paragraphs until a
+    passage reaches max_chars.
+    """
+    passages = []
+    current = ""
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if current and len(current) + len(paragraph) > max_chars:
+            passages.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        passages.append(current)
+    return passages
+
+
+class BM25Index:
+    """
+    In-memory BM25 index over passages of the design knowledge documents.
+
+    Args:
+        passages (list): Passage texts
+        k1 (float): Term frequency saturation
+        b (float): Length normalization
+    """
+    def __init__(self, passages: List[str], k1=1.5, b=0.75):
+        self.passages = passages
+        self.k1 = k1
+        self.b = b
+        self._term_freqs = [Counter(tokenize(passage)) for passage in passages]
+        self._lengths = [sum(freqs.values()) for freqs in self._term_freqs]
+        self._avg_length = (sum(self._lengths) / len(self._lengths)) if passages else 0
+        document_freqs = Counter()
+        for freqs in self._term_freqs:
+            document_freqs.update(freqs.keys())
+        total = len(passages)
+        self._idf = {
+            term: math.log(1 + (total - df + 0.5) / (df + 0.5))
+            for term, df in document_freqs.items()
+        }
+        # Inverted index: term -> passage ids, so scoring only touches candidates
+        self._postings = {}
+        for passage_id, freqs in enumerate(self._term_freqs):
+            for term in freqs:
+                self._postings.setdefault(term, []).append(passage_id)
+
+    def search(self, query: str, top_k: int) -> List[str]:
+        scores = {}
+        for term in set(tokenize(query)):
+            idf = self._idf.get(term)
+            if idf is None:
+                continue
+            for passage_id in self._postings[term]:
+                tf = self._term_freqs[passage_id][term]
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[passage_id] / self._avg_length)
+                scores[passage_id] = scores.get(passage_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [self.passages[passage_id] for passage_id, _ in ranked]
+
+
+class KnowledgeRetriever:
+    """
+    Loads KNOWLEDGE_BASE_DIR into a BM25 index on first use (or at warm-up)
+    and answers queries in-process, caching results per prompt.
+    """
+    def __init__(self, config=retrieval_config):
+        self.config = config
+        self._index = None
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+
+    def load(self) -> BM25Index:
+        with self._lock:
+            if self._index is None:
+                started = time.perf_counter()
+                passages = []
+                if os.path.isdir(self.config.knowledge_dir):
+                    for name in sorted(os.listdir(self.config.knowledge_dir)):
+                        if not name.lower().endswith(INDEXED_EXTENSIONS) or name.lower() == "readme.md":
+                            continue
+                        with open(os.path.join(self.config.knowledge_dir, name), "r", encoding="utf-8") as f:
+                            passages.extend(split_passages(f.read(), self.config.passage_chars))
+                self._index = BM25Index(passages)
+                elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+                metrics.set_gauge("retrieval.passages", len(passages))
+                metrics.set_gauge("retrieval.index_build_ms", elapsed_ms)
+                logger.info(f"Indexed {len(passages)} knowledge passages in {elapsed_ms} ms")
+            return self._index
+
+    @property
+    def available(self) -> bool:
+        return bool(self.load().passages)
+
+    def retrieve(self, query: str) -> List[str]:
+        """
+        Args:
+            query (str): Text to match, e.g. the generated design prompt
+
+        Returns:
+            list: Up to RETRIEVAL_TOP_K passages, best first
+        """
+        key = " ".join(tokenize(query))
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                metrics.increment("retrieval.cache_hits")
+                return cached
+
+        with metrics.timer("retrieval.search"):
+            passages = self.load().search(query, self.config.top_k)
+
+        with self._lock:
+            self._cache[key] = passages
+            while len(self._cache) > self.config.cache_size:
+                self._cache.popitem(last=False)
+        metrics.increment("retrieval.cache_misses")
+        return passages
+
+
+knowledge_retriever = KnowledgeRetriever()
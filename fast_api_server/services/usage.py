@@ -0,0 +1,171 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from fast_api_server.services.context_utils import message_to_dict
+from fast_api_server.services.image_utils import CHAT, resize_profile
+from fast_api_server.utils.config import usage_config
+from fast_api_server.utils.logger import logger
+from fast_api_server.utils.metrics import metrics
+from fast_api_server.utils.request_context import current_request
+from fast_api_server.utils.request_limits import BudgetExceeded
+
+# Tokens per generated image by quality (1024x1024); the image_generation tool doesn't report them
+GENERATED_IMAGE_TOKENS = {"low": 272, "medium": 1056, "high": 4160}
+CHARS_PER_TOKEN = 4
+
+USAGE_FIELDS = ("input_tokens", "cached_input_tokens", "output_tokens", "image_tokens", "calls")
+
+
+def empty_usage() -> Dict:
+    return {field: 0 for field in USAGE_FIELDS}
+
+
+def add_usage(total: Dict, usage: Dict):
+    for field in USAGE_FIELDS:
+        total[field] = total.get(field, 0) + usage.get(field, 0)
+
+
+def total_tokens(usage: Dict) -> int:
+    return usage.get("input_tokens", 0) + usage.get("output_tokens", 0) + usage.get("image_tokens", 0)
+
+
+def generated_image_tokens(route) -> int:
+    """Estimated tokens of one image generated on this route, by its image quality."""
+    return GENERATED_IMAGE_TOKENS.get(route.image_quality or "medium", GENERATED_IMAGE_TOKENS["medium"])
+
+
+def response_usage(route, response) -> Dict:
+    """Token usage of one responses.create result, plus estimated generated-image tokens."""
+    usage = empty_usage()
+    usage["calls"] = 1
+    reported = getattr(response, "usage", None)
+    if reported is not None:
+        usage["input_tokens"] = getattr(reported, "input_tokens", 0) or 0
+        usage["output_tokens"] = getattr(reported, "output_tokens", 0) or 0
+        details = getattr(reported, "input_tokens_details", None)
+        usage["cached_input_tokens"] = getattr(details, "cached_tokens", 0) or 0
+    for item in getattr(response, "output", None) or []:
+        if getattr(item, "type", None) == "image_generation_call" and getattr(item, "result", None):
+            usage["image_tokens"] += generated_image_tokens(route)
+    return usage
+
+
+class UsageTracker:
+    """
+    Aggregates token usage per endpoint and per design session (bounded LRU),
+    and per request through the RequestContext.
+    """
+    def __init__(self, config=usage_config):
+        self.config = config
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._sessions = OrderedDict()
+
+    def record(self, route, response):
+        usage = response_usage(route, response)
+        context = current_request()
+        with self._lock:
+            add_usage(self._endpoints.setdefault(route.endpoint, empty_usage()), usage)
+            if context is not None and context.session_id:
+                session = self._sessions.pop(context.session_id, None) or empty_usage()
+                add_usage(session, usage)
+                self._sessions[context.session_id] = session
+                while len(self._sessions) > self.config.max_sessions:
+                    self._sessions.popitem(last=False)
+        if context is not None:
+            add_usage(context.usage, usage)
+        for field in USAGE_FIELDS:
+            if usage[field]:
+                metrics.increment(f"usage.{route.endpoint}.{field}", usage[field])
+
+    def session_usage(self, session_id: str) -> Dict:
+        with self._lock:
+            return dict(self._sessions.get(session_id) or empty_usage())
+
+    def snapshot(self, top_sessions: int = 20) -> Dict:
+        with self._lock:
+            sessions = sorted(self._sessions.items(), key=lambda item: total_tokens(item[1]), reverse=True)
+            return {
+                "endpoints": {endpoint: dict(usage) for endpoint, usage in self._endpoints.items()},
+                "sessions_tracked": len(self._sessions),
+                "top_sessions": [
+                    {"session_id": session_id, "total_tokens": total_tokens(usage), **usage}
+                    for session_id, usage in sessions[:top_sessions]
+                ],
+                "session_token_budget": self.config.session_token_budget,
+            }
+
+
+usage_tracker = UsageTracker()
+
+
+def estimate_request_tokens(context: List, system_prompt: str = "", extra_text: str = "", image_tokens: int = 0) -> int:
+    """
+    Rough input-token estimate of a turn before it is sent. Context images
+    are counted at the chat resize profile they will be sent with.
+    """
+    chars = len(system_prompt) + len(extra_text)
+    context_image_tokens = resize_profile(CHAT).image_tokens()
+    for message in context:
+        content = message_to_dict(message).get("content")
+        if isinstance(content, str):
+            chars += len(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "input_image":
+                image_tokens += context_image_tokens
+            else:
+                chars += len(part.get("text", ""))
+    return chars // CHARS_PER_TOKEN + image_tokens
+
+
+def compact_context(context: List, keep_last: int) -> List:
+    """
+    Keep the first message (it carries the room photo, image1) and the last
+    keep_last messages; drop the turns in between.
+    """
+    if len(context) <= keep_last + 1:
+        return context
+    return [context[0]] + list(context[-keep_last:])
+
+
+def apply_session_budget(context: List, tier: Optional[str], estimated_tokens: int) -> Tuple[List, Optional[str]]:
+    """
+    Keep the current request's session under SESSION_TOKEN_BUDGET.
+
+    Past the soft threshold (SESSION_SOFT_BUDGET_PERCENT), or when this turn
+    would cross the budget, the context is compacted and the preview route
+    used. A session that has already spent its budget is refused.
+
+    Requests without a session are not budgeted.
+
+    Args:
+        context (list): Conversation context of the turn
+        tier (str): Requested route tier
+        estimated_tokens (int): Estimated tokens of this turn
+
+    Returns:
+        tuple: (context, tier) to use for the turn
+    """
+    request = current_request()
+    session_id = request.session_id if request is not None else None
+    budget = usage_config.session_token_budget
+    if not session_id or not budget:
+        return context, tier
+
+    used = total_tokens(usage_tracker.session_usage(session_id))
+    if used >= budget:
+        metrics.increment("usage.budget_rejected")
+        raise BudgetExceeded(f"Session {session_id} has used its token budget of {budget}")
+
+    soft_limit = budget * usage_config.soft_budget_percent // 100
+    if used >= soft_limit or used + estimated_tokens > budget:
+        compacted = compact_context(context, usage_config.compact_keep_messages)
+        logger.info(
+            f"Session {session_id} at {used}/{budget} tokens: "
+            f"compacting context {len(context)} -> {len(compacted)} messages, using preview route"
+        )
+        metrics.increment("usage.budget_downgraded")
+        return compacted, "preview"
+
+    return context, tier
@@ -0,0 +1,110 @@
+import asyncio
+import os
+import time
+from fast_api_server.services.image_utils import warm_up_resize
+from fast_api_server.services.retrieval import knowledge_retriever
+from fast_api_server.utils.concurrency import shutdown_pools
+from fast_api_server.utils.config import env_int
+from fast_api_server.utils.http_client import get_http_session
+from fast_api_server.utils.logger import logger
+from fast_api_server.utils.metrics import metrics
+from fast_api_server.utils.openai_client import get_client
+
+# Failed required steps are retried after this many seconds, doubling up to the max
+WARMUP_RETRY_S = env_int("WARMUP_RETRY_S", 5)
+WARMUP_RETRY_MAX_S = env_int("WARMUP_RETRY_MAX_S", 60)
+
+
+class Readiness:
+    """Tracks whether the startup warm-up has finished."""
+    def __init__(self):
+        self.ready = False
+        self.error = None
+        self.steps = {}
+        # Required steps that have not succeeded yet, by name, with their last error
+        self.failed = {}
+        self.retry_task = None
+
+    def update(self):
+        self.ready = not self.failed
+        self.error = "; ".join(f"{name}: {error}" for name, error in self.failed.items()) or None
+
+
+readiness = Readiness()
+
+
+def _ping_openai():
+    # Round trip so the TLS connection to OpenAI is already open
+    get_client().models.list()
+
+
+def _warm_up_steps():
+    """(name, step, required) for each warm-up step. Optional steps never hold back readiness."""
+    loop = asyncio.get_running_loop()
+    steps = [
+        ("openai_client", lambda: loop.run_in_executor(None, get_client), True),
+        ("http_session", lambda: loop.run_in_executor(None, get_http_session), True),
+        ("resize_pool", lambda: loop.run_in_executor(None, warm_up_resize), True),
+        ("knowledge_index", lambda: loop.run_in_executor(None, knowledge_retriever.load), True),
+    ]
+    if os.getenv("WARMUP_OPENAI_PING", "").lower() in ("1", "true", "yes"):
+        steps.append(("openai_ping", lambda: loop.run_in_executor(None, _ping_openai), False))
+    return steps
+
+
+async def _run_step(name, step, required):
+    step_started = time.perf_counter()
+    try:
+        await step()
+        readiness.failed.pop(name, None)
+    except Exception as e:
+        if required:
+            logger.error(f"Warm-up step {name} failed: {str(e)}")
+            readiness.failed[name] = str(e)
+        else:
+            logger.warning(f"Optional warm-up step {name} failed: {str(e)}")
+        metrics.increment(f"startup.{name}_failed")
+    elapsed_ms = round((time.perf_counter() - step_started) * 1000, 1)
+    readiness.steps[name] = elapsed_ms
+    metrics.set_gauge(f"startup.{name}_ms", elapsed_ms)
+
+
+async def _retry_failed_steps(steps):
+    delay = WARMUP_RETRY_S
+    while readiness.failed:
+        await asyncio.sleep(delay)
+        for name, step, required in steps:
+            if name in readiness.failed:
+                await _run_step(name, step, required)
+        readiness.update()
+        delay = min(delay * 2, WARMUP_RETRY_MAX_S)
+    logger.info("Warm-up steps recovered, ready=True")
+
+
+async def warm_up():
+    """
+    Build clients and pools before the app reports ready.
+
+    Each step is timed into metrics as startup.<step>_ms. A failing step is
+    logged but does not stop the server. A failed required step keeps /ready
+    at 503 and is retried in the background until it succeeds; a failed
+    optional step is only logged.
+    """
+    started = time.perf_counter()
+    steps = _warm_up_steps()
+    for name, step, required in steps:
+        await _run_step(name, step, required)
+
+    total_ms = round((time.perf_counter() - started) * 1000, 1)
+    metrics.set_gauge("startup.warmup_ms", total_ms)
+    readiness.update()
+    logger.info(f"Warm-up finished in {total_ms} ms, ready={readiness.ready}")
+    if readiness.failed:
+        readiness.retry_task = asyncio.ensure_future(_retry_failed_steps(steps))
+
+
+def shut_down():
+    readiness.ready = False
+    if readiness.retry_task is not None:
+        readiness.retry_task.cancel()
+    shutdown_pools()
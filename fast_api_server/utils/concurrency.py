@@ -0,0 +1,86 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from fast_api_server.utils.config import concurrency_config
+
+_limiters = {}
+_executors = {}
+
+
+def get_limiter(name: str, limit: int) -> asyncio.Semaphore:
+    """
+    Return the process-wide semaphore guarding an upstream dependency.
+
+    Args:
+        name (str): Name of the upstream ("openai", "serp", "image_fetch", ...)
+        limit (int): Number of concurrent slots, used when the limiter is first created
+
+    Returns:
+        asyncio.Semaphore: Shared semaphore for that upstream
+    """
+    limiter = _limiters.get(name)
+    if limiter is None:
+        limiter = asyncio.Semaphore(limit)
+        _limiters[name] = limiter
+    return limiter
+
+
+def openai_limiter() -> asyncio.Semaphore:
+    return get_limiter("openai", concurrency_config.openai_limit)
+
+
+def serp_limiter() -> asyncio.Semaphore:
+    return get_limiter("serp", concurrency_config.serp_limit)
+
+
+def image_fetch_limiter() -> asyncio.Semaphore:
+    return get_limiter("image_fetch", concurrency_config.image_fetch_limit)
+
+
+def get_executor(name: str, max_workers: int) -> ThreadPoolExecutor:
+    """Return a named, lazily created thread pool for blocking work."""
+    executor = _executors.get(name)
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        _executors[name] = executor
+    return executor
+
+
+def shutdown_pools():
+    """Stop the worker pools and drop limiters bound to the finished event loop."""
+    for executor in _executors.values():
+        executor.shutdown(wait=False)
+    _executors.clear()
+    _limiters.clear()
+
+
+async def run_blocking(limiter: asyncio.Semaphore, func, *args, executor=None, on_cancel=None):
+    """
+    Run a blocking call in a worker thread while holding an upstream slot.
+
+    Args:
+        limiter (asyncio.Semaphore): Semaphore bounding this kind of call
+        func (callable): Blocking function to run
+        *args: Positional arguments for func
+        executor: Optional executor, defaults to the loop's default executor
+        on_cancel (callable): Called when the caller is cancelled, before
+            waiting for the thread, to ask func to stop early
+
+    Returns:
+        Whatever func returns
+    """
+    async with limiter:
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(executor, func, *args)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The thread can't be killed; ask it to stop if it can, and keep its
+            # slot until it finishes so the limit still reflects real upstream load
+            if on_cancel is not None:
+                on_cancel()
+            await asyncio.wait([future])
+            if not future.cancelled():
+                # Retrieve the outcome; the caller has gone and won't
+                future.exception()
+            raise
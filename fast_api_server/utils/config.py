@@ -1,10 +1,273 @@
+import json
+import math
+import os
+import tempfile
+from dotenv import load_dotenv
+
+# Settings below are read from the environment, so pick up .env first
+load_dotenv()
+
+
+def env_int(name, default):
+    """Read an integer setting from the environment, falling back to default."""
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+
 class OpenAIConfig:
-    def __init__(self, 
-                 model="gpt-4o-mini", 
-                 max_tokens=1000, 
-                 temperature=0.7, 
-                 timeout_ms=30000):
+    """
+    Settings for one OpenAI call. max_tokens caps output tokens and
+    temperature is only sent when set; image_quality / image_size apply to
+    the image_generation tool. min_budget_ms is the least time left on the
+    request deadline worth starting the call with.
+    """
+    def __init__(self,
+                 model="gpt-4o-mini",
+                 max_tokens=1000,
+                 temperature=None,
+                 timeout_ms=30000,
+                 image_quality=None,
+                 image_size=None,
+                 min_budget_ms=0):
         self.model = model
         self.max_tokens = max_tokens
         self.temperature = temperature
-        self.timeout_ms = timeout_ms
\ No newline at end of file
+        self.timeout_ms = timeout_ms
+        self.image_quality = image_quality
+        self.image_size = image_size
+        self.min_budget_ms = min_budget_ms
+
+    def response_kwargs(self):
+        """Arguments for client.responses.create that this config controls."""
+        kwargs = {"model": self.model}
+        if self.max_tokens:
+            kwargs["max_output_tokens"] = self.max_tokens
+        if self.temperature is not None:
+            kwargs["temperature"] = self.temperature
+        if self.timeout_ms:
+            kwargs["timeout"] = self.timeout_ms / 1000
+        return kwargs
+
+    def image_generation_tool(self):
+        return {
+            "type": "image_generation",
+            "size": self.image_size or "auto",
+            "quality": self.image_quality or "medium"
+        }
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+class ResizeProfile:
+    """
+    How images are resized for one stage of the pipeline. max_side bounds the
+    long edge; smaller images are only enlarged when upscale is set. canvas
+    pads to a max_side square instead of keeping the aspect ratio. detail is
+    the OpenAI input_image detail level the result is sent with.
+    """
+    def __init__(self, name, max_side=512, canvas=False, upscale=False, detail="auto"):
+        self.name = name
+        self.max_side = max_side
+        self.canvas = canvas
+        self.upscale = upscale
+        self.detail = detail
+
+    def target_size(self, width, height):
+        """Size the image is scaled to, before any canvas padding."""
+        scale = self.max_side / max(width, height)
+        if scale > 1 and not self.upscale:
+            scale = 1
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    def image_tokens(self, width=None, height=None):
+        """
+        Input tokens OpenAI bills for an image of this size at this detail
+        level; without a size, for the largest image the profile produces.
+        """
+        if self.detail == "low":
+            return 85
+        if width is None or height is None:
+            width = height = self.max_side
+        # High detail: fit within 2048x2048, shortest side down to 768, then 170 per 512px tile
+        scale = min(1, 2048 / max(width, height))
+        scale = min(scale, 768 / min(width, height))
+        tiles = math.ceil(width * scale / 512) * math.ceil(height * scale / 512)
+        return 85 + 170 * tiles
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+class ConcurrencyConfig:
+    """
+    Upper bounds on concurrent work per upstream dependency.
+
+    Shared by live requests and batch jobs so a large batch cannot open more
+    OpenAI / SerpAPI connections or resize threads than the process allows.
+    """
+    def __init__(self,
+                 openai_limit=None,
+                 serp_limit=None,
+                 image_fetch_limit=None,
+                 resize_workers=None,
+                 batch_item_limit=None,
+                 max_variants=None,
+                 variant_limit=None):
+        self.openai_limit = openai_limit or env_int("OPENAI_MAX_CONCURRENCY", 8)
+        self.serp_limit = serp_limit or env_int("SERP_MAX_CONCURRENCY", 8)
+        self.image_fetch_limit = image_fetch_limit or env_int("IMAGE_FETCH_MAX_CONCURRENCY", 16)
+        self.resize_workers = resize_workers or env_int("RESIZE_WORKERS", min(4, os.cpu_count() or 1))
+        self.batch_item_limit = batch_item_limit or env_int("BATCH_MAX_CONCURRENCY", 4)
+        self.max_variants = max_variants or env_int("MAX_VARIANTS", 4)
+        # Variant renders of one request running at once
+        self.variant_limit = variant_limit or env_int("VARIANT_MAX_CONCURRENCY", 2)
+
+
+class ImageConfig:
+    """Limits for the image resize pipeline and conversation context images."""
+    def __init__(self,
+                 resize_cache_max_bytes=None,
+                 context_image_byte_budget=None,
+                 fetch_cache_max_bytes=None,
+                 prefetch_workers=None,
+                 prefetch_max_pending=None,
+                 prefetch_per_product=None):
+        self.resize_cache_max_bytes = resize_cache_max_bytes or env_int("RESIZE_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+        self.context_image_byte_budget = context_image_byte_budget or env_int("CONTEXT_IMAGE_BYTE_BUDGET", 2 * 1024 * 1024)
+        self.fetch_cache_max_bytes = fetch_cache_max_bytes or env_int("FETCH_CACHE_MAX_BYTES", 32 * 1024 * 1024)
+        # Product thumbnail prefetch; PREFETCH_WORKERS=0 disables it
+        self.prefetch_workers = prefetch_workers if prefetch_workers is not None else env_int("PREFETCH_WORKERS", 2)
+        self.prefetch_max_pending = prefetch_max_pending or env_int("PREFETCH_MAX_PENDING", 64)
+        self.prefetch_per_product = prefetch_per_product or env_int("PREFETCH_PER_PRODUCT", 2)
+        # Resize profile per stage; RESIZE_PROFILES (JSON) overrides settings by profile name
+        self.resize_profiles = {
+            # Room photo: the geometry reference (image1) for image generation
+            "room": {"max_side": 1024, "detail": "high"},
+            # Product thumbnails given to image generation
+            "product": {"max_side": 512, "detail": "low"},
+            # Images in the design chat and earlier conversation turns
+            "chat": {"max_side": 512, "detail": "low"},
+        }
+        for name, overrides in json.loads(os.getenv("RESIZE_PROFILES", "{}") or "{}").items():
+            self.resize_profiles[name] = {**self.resize_profiles.get(name, {}), **overrides}
+
+
+class GenerationCacheConfig:
+    """Sizes and location of the generated-design cache."""
+    def __init__(self,
+                 memory_max_bytes=None,
+                 disk_max_bytes=None,
+                 disk_dir=None):
+        self.memory_max_bytes = memory_max_bytes or env_int("GENERATION_CACHE_MEMORY_BYTES", 64 * 1024 * 1024)
+        self.disk_max_bytes = disk_max_bytes or env_int("GENERATION_CACHE_DISK_BYTES", 1024 * 1024 * 1024)
+        self.disk_dir = disk_dir or os.getenv(
+            "GENERATION_CACHE_DIR",
+            os.path.join(tempfile.gettempdir(), "muralink-generations")
+        )
+
+
+class RequestLimitsConfig:
+    """Payload caps and the memory budget used for admission control."""
+    def __init__(self,
+                 max_body_bytes=None,
+                 batch_max_body_bytes=None,
+                 max_images=None,
+                 max_decoded_pixels=None,
+                 memory_budget_bytes=None,
+                 admission_wait_ms=None):
+        self.max_body_bytes = max_body_bytes or env_int("MAX_BODY_BYTES", 25 * 1024 * 1024)
+        self.batch_max_body_bytes = batch_max_body_bytes or env_int("BATCH_MAX_BODY_BYTES", 256 * 1024 * 1024)
+        self.max_images = max_images or env_int("MAX_IMAGES_PER_REQUEST", 12)
+        self.max_decoded_pixels = max_decoded_pixels or env_int("MAX_DECODED_PIXELS", 40_000_000)
+        self.memory_budget_bytes = memory_budget_bytes or env_int("REQUEST_MEMORY_BUDGET_BYTES", 768 * 1024 * 1024)
+        self.admission_wait_ms = admission_wait_ms or env_int("ADMISSION_WAIT_MS", 15000)
+
+
+class RateLimitConfig:
+    """
+    Token buckets per client and class of work, and fair-queue capacity.
+
+    Rates are requests per minute; burst is the bucket size. Slots are how
+    many requests of that class run at once across all clients.
+    """
+    def __init__(self):
+        self.enabled = os.getenv("RATE_LIMIT_ENABLED", "true").lower() not in ("0", "false", "no")
+        self.backend = os.getenv("RATE_LIMIT_BACKEND", "memory")
+        self.redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        self.buckets = {
+            "chat": (env_int("CHAT_RATE_PER_MINUTE", 30), env_int("CHAT_BURST", 10)),
+            "generation": (env_int("GENERATION_RATE_PER_MINUTE", 6), env_int("GENERATION_BURST", 3)),
+            "batch": (env_int("BATCH_RATE_PER_MINUTE", 2), env_int("BATCH_BURST", 2)),
+        }
+        self.slots = {
+            "chat": env_int("CHAT_SLOTS", 16),
+            "generation": env_int("GENERATION_SLOTS", 4),
+        }
+        # Optional JSON object of client key -> fair-queue weight (default 1)
+        self.client_weights = json.loads(os.getenv("CLIENT_WEIGHTS", "{}") or "{}")
+        # Proxies in front of the app that append to X-Forwarded-For; 0 trusts only the socket peer
+        self.trusted_proxy_hops = env_int("TRUSTED_PROXY_HOPS", 1)
+        # Comma-separated X-Api-Key values that identify a client; other keys are ignored
+        self.api_keys = {key.strip() for key in os.getenv("RATE_LIMIT_API_KEYS", "").split(",") if key.strip()}
+
+
+class RetrievalConfig:
+    """Local knowledge base used instead of the remote file_search tool."""
+    def __init__(self):
+        self.knowledge_dir = os.getenv(
+            "KNOWLEDGE_BASE_DIR",
+            os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "knowledge")
+        )
+        self.top_k = env_int("RETRIEVAL_TOP_K", 4)
+        self.passage_chars = env_int("RETRIEVAL_PASSAGE_CHARS", 800)
+        self.cache_size = env_int("RETRIEVAL_CACHE_SIZE", 512)
+        # Used only when the local knowledge base is empty
+        self.fallback_vector_store_id = os.getenv("FILE_SEARCH_VECTOR_STORE_ID", "vs_684752e9fc008191a0a8e3acc7642b9a")
+
+
+class DeadlineConfig:
+    """End-to-end time budgets per endpoint; clients may ask for less with X-Request-Deadline-Ms."""
+    def __init__(self):
+        self.budgets_ms = {
+            "chat": env_int("CHAT_DEADLINE_MS", 90000),
+            "generation": env_int("GENERATION_DEADLINE_MS", 300000),
+        }
+        self.disconnect_poll_ms = env_int("DISCONNECT_POLL_MS", 250)
+
+
+class UsageConfig:
+    """Per-session token budgets and the admin token for /admin/usage."""
+    def __init__(self):
+        # 0 disables the budget
+        self.session_token_budget = env_int("SESSION_TOKEN_BUDGET", 1_000_000)
+        # Share of the budget after which context is compacted and the preview route used
+        self.soft_budget_percent = env_int("SESSION_SOFT_BUDGET_PERCENT", 80)
+        self.compact_keep_messages = env_int("COMPACT_KEEP_MESSAGES", 6)
+        self.max_sessions = env_int("USAGE_MAX_SESSIONS", 10000)
+        self.admin_token = os.getenv("ADMIN_TOKEN")
+
+
+class DesignSessionConfig:
+    """Server-side conversation state kept for the WebSocket design session endpoint."""
+    def __init__(self):
+        self.max_sessions = env_int("DESIGN_SESSION_MAX", 1000)
+        self.idle_ttl_s = env_int("DESIGN_SESSION_IDLE_TTL_S", 3600)
+        # Largest client frame; a frame carries at most one new image
+        self.max_frame_bytes = env_int("DESIGN_SESSION_MAX_FRAME_BYTES", 16 * 1024 * 1024)
+
+
+concurrency_config = ConcurrencyConfig()
+image_config = ImageConfig()
+generation_cache_config = GenerationCacheConfig()
+request_limits_config = RequestLimitsConfig()
+rate_limit_config = RateLimitConfig()
+retrieval_config = RetrievalConfig()
+deadline_config = DeadlineConfig()
+usage_config = UsageConfig()
+design_session_config = DesignSessionConfig()
@@ -0,0 +1,83 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from fast_api_server.utils.config import rate_limit_config
+from fast_api_server.utils.metrics import metrics
+
+
+class FairScheduler:
+    """
+    Weighted fair queuing over a fixed number of slots.
+
+    Each request gets a virtual finish tag of max(virtual time, the client's
+    previous tag) + cost / weight, and free slots go to the smallest tag. A
+    client with many queued requests therefore takes turns with everyone
+    else instead of draining the queue first.
+    """
+    def __init__(self, name, slots):
+        self.name = name
+        self.slots = slots
+        self.in_use = 0
+        self.virtual_time = 0.0
+        self._last_finish = {}
+        self._waiters = []
+        self._sequence = itertools.count()
+
+    def _grant_next(self):
+        while self._waiters and self.in_use < self.slots:
+            start, _, _, future = heapq.heappop(self._waiters)[1:]
+            if future.done():
+                continue
+            self.in_use += 1
+            self.virtual_time = max(self.virtual_time, start)
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, client_key: str, cost: float = 1.0):
+        weight = rate_limit_config.client_weights.get(client_key, 1.0)
+        start = max(self.virtual_time, self._last_finish.get(client_key, 0.0))
+        finish = start + cost / weight
+        self._last_finish[client_key] = finish
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (finish, start, next(self._sequence), client_key, future))
+        self._grant_next()
+
+        queued = time.perf_counter()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just as we were cancelled; hand the slot on
+                self.in_use -= 1
+                self._grant_next()
+            raise
+        metrics.observe(f"fair_queue.{self.name}.wait_ms", (time.perf_counter() - queued) * 1000)
+        metrics.set_gauge(f"fair_queue.{self.name}.queued", len(self._waiters))
+
+        try:
+            yield
+        finally:
+            self.in_use -= 1
+            self._grant_next()
+            if not self._waiters and self.in_use == 0:
+                # Idle: forget old tags so they don't grow without bound
+                self._last_finish.clear()
+            elif len(self._last_finish) > self.slots + len(self._waiters):
+                # A tag at or behind virtual time no longer changes a client's start
+                self._last_finish = {
+                    key: tag for key, tag in self._last_finish.items() if tag > self.virtual_time
+                }
+
+
+_schedulers = {}
+
+
+def fair_scheduler(kind: str) -> FairScheduler:
+    scheduler = _schedulers.get(kind)
+    if scheduler is None:
+        scheduler = FairScheduler(kind, rate_limit_config.slots[kind])
+        _schedulers[kind] = scheduler
+    return scheduler
@@ -0,0 +1,30 @@
+import threading
+from fast_api_server.utils.config import concurrency_config
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """
+    Return the shared requests.Session used for product image downloads.
+
+    Reusing one session keeps connections to image CDNs open between
+    requests; the pool is sized to the image fetch concurrency limit.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=concurrency_config.image_fetch_limit,
+                    pool_maxsize=concurrency_config.image_fetch_limit
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
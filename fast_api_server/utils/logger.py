@@ -1,9 +1,16 @@
 import logging
 import os
 
-# Ensure logs directory exists
+# Log file is created on first write, not at import
 LOG_DIR = "logs"
-os.makedirs(LOG_DIR, exist_ok=True)
+
+
+class LazyFileHandler(logging.FileHandler):
+    """FileHandler that creates the log directory when the file is first opened."""
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
+
 
 # Logger setup
 logger = logging.getLogger("ImageProcessingLogger")
@@ -23,7 +30,7 @@ if not any(isinstance(h, logging.StreamHandler) for h in logger.handlers):
     logger.addHandler(console_handler)
 
 if not any(isinstance(h, logging.FileHandler) for h in logger.handlers):
-    file_handler = logging.FileHandler(os.path.join(LOG_DIR, "app.log"))
+    file_handler = LazyFileHandler(os.path.join(LOG_DIR, "app.log"), delay=True)
     file_handler.setLevel(logging.DEBUG)
     file_handler.setFormatter(formatter)
     logger.addHandler(file_handler)
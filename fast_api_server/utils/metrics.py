@@ -0,0 +1,64 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Metrics:
+    """
+    In-process counters, gauges and observations (count / total / max / avg
+    of a value, e.g. a latency), exposed at /api/v1/metrics.
+
+    Thread-safe because blocking stages (resizes, OpenAI calls) record from
+    worker threads.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._observations = {}
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name, value):
+        with self._lock:
+            observation = self._observations.get(name)
+            if observation is None:
+                observation = self._observations[name] = {"count": 0, "total": 0.0, "max": 0.0}
+            observation["count"] += 1
+            observation["total"] += value
+            observation["max"] = max(observation["max"], value)
+
+    @contextmanager
+    def timer(self, name):
+        """Observe the duration of the block as <name>_ms."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(f"{name}_ms", (time.perf_counter() - started) * 1000)
+
+    def snapshot(self):
+        with self._lock:
+            observations = {
+                name: {
+                    "count": observation["count"],
+                    "total": round(observation["total"], 2),
+                    "max": round(observation["max"], 2),
+                    "avg": round(observation["total"] / observation["count"], 2),
+                }
+                for name, observation in self._observations.items()
+            }
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "observations": observations,
+            }
+
+
+metrics = Metrics()
@@ -1,7 +1,144 @@
 import os
-from openai import OpenAI
-from dotenv import load_dotenv
+import threading
+from functools import partial
+from fast_api_server.utils.concurrency import openai_limiter, run_blocking
+from fast_api_server.utils.metrics import metrics
+from fast_api_server.utils.request_context import current_request
+from fast_api_server.utils.request_limits import RequestCancelled
 
-load_dotenv()
+_client = None
+_client_lock = threading.Lock()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+def get_client():
+    """
+    Return the shared OpenAI client, building it on first use.
+
+    The openai package is imported here rather than at module import so
+    workers boot without paying for it; the lifespan warm-up calls this
+    before the app reports ready.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from openai import OpenAI
+                _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _client
+
+
+async def create_response(**kwargs):
+    """
+    Call client.responses.create off the event loop, bounded by the OpenAI limiter.
+
+    The call is made as a stream and only the final Response is kept, so a
+    cancelled caller can close it like stream_response does instead of
+    holding the worker and the limiter slot until OpenAI finishes.
+
+    Args:
+        **kwargs: Arguments forwarded to client.responses.create
+
+    Returns:
+        The OpenAI Response object
+    """
+    return await stream_response(_ignore_event, **kwargs)
+
+
+def _ignore_event(event):
+    pass
+
+
+class StreamFailed(Exception):
+    """A streamed response ended in a failure, error or incomplete event."""
+
+
+def stream_failure(event):
+    """Error message for an event that ends a stream unsuccessfully, else None."""
+    if event.type == "error":
+        return f"OpenAI stream error: {getattr(event, 'message', None) or getattr(event, 'code', None)}"
+    if event.type == "response.failed":
+        error = getattr(event.response, "error", None)
+        return f"OpenAI response failed: {getattr(error, 'message', None) or error}"
+    if event.type == "response.incomplete":
+        details = getattr(event.response, "incomplete_details", None)
+        return f"OpenAI response incomplete: {getattr(details, 'reason', None) or details}"
+    return None
+
+
+class StreamControl:
+    """
+    Lets the event loop stop a stream that a worker thread is reading. Closing
+    the stream also breaks a read that is waiting for the next event.
+    """
+    def __init__(self, request=None):
+        self.request = request
+        self.stream = None
+        self._stopped = threading.Event()
+
+    @property
+    def stopped(self):
+        return self._stopped.is_set() or (self.request is not None and self.request.cancelled)
+
+    def stop(self):
+        self._stopped.set()
+        stream = self.stream
+        if stream is not None:
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+
+def sync_stream_response(on_event, control=None, **kwargs):
+    """
+    Run a streaming responses.create call, passing each event to on_event.
+
+    Args:
+        control (StreamControl): Optional; once stopped the stream is closed
+
+    Returns:
+        The final Response from the response.completed event
+
+    Raises:
+        StreamFailed: The stream failed, errored, stopped incomplete or ended
+            without completing
+        RequestCancelled: The stream was stopped through control
+    """
+    control = control or StreamControl()
+    stream = get_client().responses.create(stream=True, **kwargs)
+    control.stream = stream
+    try:
+        for event in stream:
+            if control.stopped:
+                break
+            on_event(event)
+            if event.type == "response.completed":
+                return event.response
+            failure = stream_failure(event)
+            if failure:
+                raise StreamFailed(failure)
+    except Exception:
+        if not control.stopped:
+            raise
+    finally:
+        stream.close()
+    if control.stopped:
+        metrics.increment("cancellation.openai_stream_closed")
+        raise RequestCancelled("Stream stopped: request cancelled")
+    raise StreamFailed("OpenAI stream ended without a completed response")
+
+
+async def stream_response(on_event, **kwargs):
+    """
+    Streaming variant of create_response. on_event runs on the worker thread,
+    so it should only hand events over (e.g. loop.call_soon_threadsafe).
+
+    If the caller is cancelled or its request is, the stream is closed, which
+    frees the OpenAI slot instead of reading the response to the end.
+    """
+    control = StreamControl(current_request())
+    return await run_blocking(
+        openai_limiter(),
+        partial(sync_stream_response, on_event, control, **kwargs),
+        on_cancel=control.stop
+    )
@@ -0,0 +1,182 @@
+import math
+import threading
+import time
+from fastapi import Request
+from starlette.requests import HTTPConnection
+from fast_api_server.utils.config import rate_limit_config
+from fast_api_server.utils.logger import logger
+from fast_api_server.utils.metrics import metrics
+from fast_api_server.utils.request_limits import RateLimited
+
+
+def client_key(request: HTTPConnection) -> str:
+    """
+    Identify the caller: an allow-listed API key if sent, else the address
+    the outermost trusted proxy saw (the app runs behind a proxy on Azure),
+    else the socket peer.
+
+    Everything left of the trusted hops in X-Forwarded-For is written by the
+    client, so it is never used.
+    """
+    api_key = request.headers.get("x-api-key")
+    if api_key and api_key in rate_limit_config.api_keys:
+        return f"key:{api_key}"
+    hops = rate_limit_config.trusted_proxy_hops
+    forwarded = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    if hops > 0 and len(forwarded) >= hops:
+        return f"ip:{forwarded[-hops]}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+class RateLimitBackend:
+    """
+    Storage for token buckets. Subclass and pass to set_rate_limit_backend to
+    share limits between workers or instances.
+    """
+    async def take(self, key: str, rate_per_minute: int, burst: int, cost: int = 1):
+        """
+        Try to take cost tokens from the bucket named key.
+
+        Returns:
+            tuple: (allowed, seconds until enough tokens are available);
+            math.inf when they never will be (cost above burst, or no refill)
+        """
+        raise NotImplementedError
+
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    """
+    Per-process buckets; limits are per worker when running several.
+
+    A bucket that has refilled completely is the same as a new one, so those
+    are swept every SWEEP_INTERVAL_S to keep memory bounded by active clients.
+    """
+    SWEEP_INTERVAL_S = 60
+
+    def __init__(self):
+        # key -> (tokens, updated, time the bucket is full again)
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + self.SWEEP_INTERVAL_S
+
+    def _sweep(self, now):
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if bucket[2] > now}
+        self._next_sweep = now + self.SWEEP_INTERVAL_S
+        metrics.set_gauge("rate_limit.buckets", len(self._buckets))
+
+    async def take(self, key, rate_per_minute, burst, cost=1):
+        if cost > burst:
+            return False, math.inf
+        rate = rate_per_minute / 60
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            tokens, updated, _ = self._buckets.get(key, (burst, now, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            full_at = now + (burst - tokens) / rate if rate else math.inf
+            self._buckets[key] = (tokens, now, full_at)
+            if allowed:
+                return True, 0
+            return False, (cost - tokens) / rate if rate else math.inf
+
+
+class RedisRateLimitBackend(RateLimitBackend):
+    """
+    Buckets in Redis, shared by every worker. Needs the optional `redis`
+    package; the refill-and-take runs as one Lua script so it is atomic.
+    """
+    SCRIPT = """
+    local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+    local updated = tonumber(redis.call('HGET', KEYS[1], 'updated'))
+    local rate, burst, cost, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+    if tokens == nil then tokens = burst; updated = now end
+    tokens = math.min(burst, tokens + (now - updated) * rate)
+    local allowed = 0
+    if tokens >= cost then tokens = tokens - cost; allowed = 1 end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 60)
+    return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, url):
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(url)
+        self._script = self._redis.register_script(self.SCRIPT)
+
+    async def take(self, key, rate_per_minute, burst, cost=1):
+        if cost > burst:
+            return False, math.inf
+        rate = rate_per_minute / 60
+        allowed, tokens = await self._script(
+            keys=[f"ratelimit:{key}"], args=[rate, burst, cost, time.time()]
+        )
+        if int(allowed):
+            return True, 0
+        return False, (cost - float(tokens)) / rate if rate else math.inf
+
+
+_backend = None
+
+
+def get_rate_limit_backend() -> RateLimitBackend:
+    global _backend
+    if _backend is None:
+        if rate_limit_config.backend == "redis":
+            try:
+                _backend = RedisRateLimitBackend(rate_limit_config.redis_url)
+            except ImportError:
+                logger.error("RATE_LIMIT_BACKEND=redis but the redis package is not installed, using memory")
+                _backend = InMemoryRateLimitBackend()
+        else:
+            _backend = InMemoryRateLimitBackend()
+    return _backend
+
+
+def set_rate_limit_backend(backend: RateLimitBackend):
+    global _backend
+    _backend = backend
+
+
+async def check_rate_limit(kind: str, key: str, cost: int = 1):
+    """
+    Take cost tokens from the client's bucket for a class of work, e.g. one
+    per requested design variant. The charge is capped at the bucket size,
+    so a request costing more than the burst takes a full bucket rather
+    than being refused forever.
+
+    Raises:
+        RateLimited: The bucket is empty; carries a Retry-After header unless
+            the bucket can never hold enough tokens
+    """
+    if not rate_limit_config.enabled:
+        return
+    rate_per_minute, burst = rate_limit_config.buckets[kind]
+    cost = min(cost, burst) if burst > 0 else cost
+    allowed, retry_after = await get_rate_limit_backend().take(f"{kind}:{key}", rate_per_minute, burst, cost)
+    if not allowed:
+        metrics.increment(f"rate_limit.{kind}.rejected")
+        if math.isinf(retry_after):
+            raise RateLimited(f"{kind.capitalize()} requests are not allowed by the current rate limits")
+        raise RateLimited(
+            f"Too many {kind} requests, retry in {math.ceil(retry_after)}s",
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
+    metrics.increment(f"rate_limit.{kind}.allowed")
+
+
+def rate_limit(kind: str):
+    """
+    FastAPI dependency enforcing the token bucket for one class of work
+    ("chat", "generation" or "batch") and returning the client key.
+    """
+    async def dependency(request: Request) -> str:
+        key = client_key(request)
+        await check_rate_limit(kind, key)
+        return key
+
+    return dependency
@@ -0,0 +1,127 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Optional
+from starlette.requests import HTTPConnection
+from fast_api_server.utils.config import deadline_config
+from fast_api_server.utils.logger import logger
+from fast_api_server.utils.metrics import metrics
+from fast_api_server.utils.request_limits import DeadlineExceeded, RequestCancelled
+
+
+class RequestContext:
+    """
+    Deadline and cancellation state of one request, visible to every stage
+    through current_request().
+    """
+    def __init__(self, endpoint: str, budget_s: float, session_id: Optional[str] = None):
+        self.endpoint = endpoint
+        self.deadline = time.monotonic() + budget_s
+        self.cancel_reason = None
+        self.session_id = session_id
+        # Token usage of every OpenAI call made for this request
+        self.usage = {}
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_reason is not None
+
+    def cancel(self, reason: str):
+        if self.cancel_reason is None:
+            self.cancel_reason = reason
+            metrics.increment(f"cancellation.{self.endpoint}.{reason}")
+
+
+_current_request: ContextVar[Optional[RequestContext]] = ContextVar("current_request", default=None)
+
+
+def current_request() -> Optional[RequestContext]:
+    return _current_request.get()
+
+
+def checkpoint(stage: str, needed_s: float = 0):
+    """
+    Stop before a stage if the client has gone or the deadline leaves less
+    than needed_s. Skipped stages are counted as capacity saved. Outside a
+    request scope (batch jobs, CLI) this does nothing.
+
+    Raises:
+        RequestCancelled: The client disconnected
+        DeadlineExceeded: Not enough time left to finish the stage
+    """
+    context = current_request()
+    if context is None:
+        return
+    if context.cancelled:
+        metrics.increment(f"cancellation.skipped.{stage}")
+        raise RequestCancelled(f"Request cancelled ({context.cancel_reason}) before {stage}")
+    if context.remaining() < needed_s:
+        context.cancel("deadline")
+        metrics.increment(f"cancellation.skipped.{stage}")
+        raise DeadlineExceeded(f"Not enough time left for {stage}")
+
+
+def stage_timeout(default_s: Optional[float]) -> Optional[float]:
+    """Timeout for an upstream call: its default, cut to the time left on the deadline."""
+    context = current_request()
+    if context is None:
+        return default_s
+    remaining = max(context.remaining(), 0.1)
+    return min(default_s, remaining) if default_s else remaining
+
+
+def requested_budget_s(request: HTTPConnection, endpoint: str) -> float:
+    budget_ms = deadline_config.budgets_ms[endpoint]
+    header = request.headers.get("x-request-deadline-ms", "")
+    if header.isdigit():
+        budget_ms = min(budget_ms, int(header))
+    return budget_ms / 1000
+
+
+@asynccontextmanager
+async def request_scope(request: HTTPConnection, endpoint: str, watch_disconnect: bool = True, session_id: Optional[str] = None):
+    """
+    Run a request under a deadline, cancelling its work if the client leaves.
+
+    Args:
+        request (Request): Incoming request (or WebSocket), polled for disconnects
+        endpoint (str): "chat" or "generation", selects the deadline budget
+        watch_disconnect (bool): Poll for disconnects and cancel the handler.
+            Streaming responses already stop when the client goes, so they pass False.
+        session_id (str): Design session for usage accounting, defaults to the X-Session-Id header
+    """
+    session_id = session_id or request.headers.get("x-session-id") or None
+    context = RequestContext(endpoint, requested_budget_s(request, endpoint), session_id)
+    token = _current_request.set(context)
+    task = asyncio.current_task()
+
+    async def watch():
+        while True:
+            await asyncio.sleep(deadline_config.disconnect_poll_ms / 1000)
+            if await request.is_disconnected():
+                context.cancel("disconnect")
+                logger.info(f"Client disconnected, cancelling {endpoint} request")
+                task.cancel()
+                return
+
+    watcher = asyncio.ensure_future(watch()) if watch_disconnect else None
+    try:
+        yield context
+    except asyncio.CancelledError:
+        if context.cancel_reason != "disconnect":
+            raise
+        # Our own cancellation: surface it as a normal error so slots are released cleanly
+        if hasattr(task, "uncancel"):
+            task.uncancel()
+        raise RequestCancelled("Client disconnected")
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        _current_request.reset(token)
+        metrics.observe(f"deadline.{endpoint}.remaining_ms", max(context.remaining(), 0) * 1000)
+        if context.usage:
+            logger.info(f"{endpoint} request usage (session {context.session_id}): {context.usage}")
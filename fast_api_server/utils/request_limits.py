@@ -0,0 +1,218 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from typing import Iterable, List, Optional
+from fastapi import HTTPException
+from fast_api_server.utils.config import request_limits_config
+from fast_api_server.utils.metrics import metrics
+
+# Rough per-image costs, see estimate_image_memory
+# Decoded plus resized copy at the largest default resize profile (room, 1024 px)
+RESIZED_IMAGE_BYTES = 1024 * 1024 * 4 * 2
+FETCHED_IMAGE_ESTIMATE_BYTES = 4 * 1024 * 1024
+JPEG_EXPANSION = 10
+
+
+class RequestLimitError(HTTPException):
+    """
+    Base class for requests refused by a payload cap or admission control.
+
+    An HTTPException so it also passes through FastAPI's body parsing when
+    raised from BodySizeLimitMiddleware.
+    """
+    status_code = 400
+
+    def __init__(self, message, headers=None):
+        super().__init__(status_code=type(self).status_code, detail=message, headers=headers)
+
+
+class RequestTooLarge(RequestLimitError):
+    status_code = 413
+
+
+class ServerBusy(RequestLimitError):
+    status_code = 503
+
+
+class RateLimited(RequestLimitError):
+    status_code = 429
+
+
+class BudgetExceeded(RequestLimitError):
+    status_code = 429
+
+
+class DeadlineExceeded(RequestLimitError):
+    status_code = 504
+
+
+class RequestCancelled(RequestLimitError):
+    # Client closed the connection; nobody reads this response
+    status_code = 499
+
+
+def check_decoded_pixels(width: int, height: int):
+    """Refuse an image by its header size, before any pixels are decoded."""
+    pixels = width * height
+    if pixels > request_limits_config.max_decoded_pixels:
+        metrics.increment("limits.rejected_pixels")
+        raise RequestTooLarge(
+            f"Image is {width}x{height} ({pixels} pixels), limit is {request_limits_config.max_decoded_pixels}"
+        )
+
+
+def context_images(context) -> List[str]:
+    """Inline and remote image URLs inside a multimodal context."""
+    images = []
+    for message in context or []:
+        content = message.get("content") if isinstance(message, dict) else message.content
+        if isinstance(content, list):
+            for part in content:
+                if part.get("type") == "input_image" and isinstance(part.get("image_url"), str):
+                    images.append(part["image_url"])
+    return images
+
+
+def estimate_image_memory(image: str) -> int:
+    """
+    Peak bytes one image costs while it is processed: the base64 string, the
+    decoded bytes, the decoded pixels (estimated from a typical JPEG ratio and
+    capped by MAX_DECODED_PIXELS) and the resize canvases. Remote URLs use a
+    flat estimate since their size isn't known before download.
+    """
+    if not image.startswith("data:") and len(image) < 4096:
+        return FETCHED_IMAGE_ESTIMATE_BYTES + RESIZED_IMAGE_BYTES
+    encoded = len(image)
+    decoded = encoded * 3 // 4
+    pixels = min(decoded * JPEG_EXPANSION, request_limits_config.max_decoded_pixels * 4)
+    return encoded + decoded + pixels + RESIZED_IMAGE_BYTES
+
+
+def check_and_estimate(images: Iterable[Optional[str]], body_bytes: int = 0, context=None) -> int:
+    """
+    Enforce the per-request image count and return the estimated memory cost.
+
+    Only the new images count towards MAX_IMAGES_PER_REQUEST. Clients resend
+    the whole conversation each turn, and prepare_context already dedupes and
+    byte-budgets its images, so context images only add to the estimate, each
+    distinct image once.
+
+    Args:
+        images (iterable): Room and product images of this turn (data URLs, base64 or URLs)
+        body_bytes (int): Size of the parsed request body, counted once
+        context (list): Conversation context, if the request carries one
+
+    Returns:
+        int: Estimated peak bytes for the request
+    """
+    images = [image for image in images if image]
+    if len(images) > request_limits_config.max_images:
+        metrics.increment("limits.rejected_image_count")
+        raise RequestTooLarge(f"Request has {len(images)} images, limit is {request_limits_config.max_images}")
+    unique_context_images = set(context_images(context)) - set(images)
+    return body_bytes + sum(estimate_image_memory(image) for image in images + list(unique_context_images))
+
+
+class MemoryAdmission:
+    """
+    Admits requests while their summed memory estimates fit the budget.
+
+    Requests that don't fit wait up to ADMISSION_WAIT_MS for others to finish,
+    then are refused with ServerBusy. A request larger than the whole budget is
+    still admitted when nothing else is running, so it can't wait forever.
+    """
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self.in_use = 0
+        self.peak = 0
+        self._condition = None
+
+    def _fits(self, nbytes):
+        return self.in_use == 0 or self.in_use + nbytes <= self.budget_bytes
+
+    @asynccontextmanager
+    async def reserve(self, nbytes: int, wait_ms: Optional[int] = None):
+        """
+        Args:
+            nbytes (int): Estimated peak bytes of the request
+            wait_ms (int): How long to wait for room, defaults to ADMISSION_WAIT_MS; 0 waits forever
+        """
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        if wait_ms is None:
+            wait_ms = request_limits_config.admission_wait_ms
+
+        async with self._condition:
+            try:
+                await asyncio.wait_for(
+                    self._condition.wait_for(lambda: self._fits(nbytes)),
+                    timeout=wait_ms / 1000 if wait_ms else None
+                )
+            except asyncio.TimeoutError:
+                metrics.increment("memory.rejected")
+                raise ServerBusy("Server is at its memory budget, retry shortly")
+            self.in_use += nbytes
+            self.peak = max(self.peak, self.in_use)
+
+        metrics.increment("memory.admitted")
+        metrics.set_gauge("memory.in_use_bytes", self.in_use)
+        metrics.set_gauge("memory.peak_bytes", self.peak)
+        metrics.observe("memory.request_estimate_bytes", nbytes)
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.in_use -= nbytes
+                self._condition.notify_all()
+            metrics.set_gauge("memory.in_use_bytes", self.in_use)
+
+
+memory_admission = MemoryAdmission(request_limits_config.memory_budget_bytes)
+
+
+class BodySizeLimitMiddleware:
+    """
+    ASGI middleware refusing request bodies over MAX_BODY_BYTES (batch paths:
+    BATCH_MAX_BODY_BYTES). Checks Content-Length up front and counts streamed
+    chunks, so oversized uploads are cut off before they are buffered or parsed.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    def _limit(self, path):
+        if path.endswith("/batch"):
+            return request_limits_config.batch_max_body_bytes
+        return request_limits_config.max_body_bytes
+
+    async def _reject(self, send, limit):
+        metrics.increment("limits.rejected_body")
+        body = json.dumps({"error": f"Request body is larger than {limit} bytes"}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        limit = self._limit(scope.get("path", ""))
+        for name, value in scope.get("headers", []):
+            if name == b"content-length" and value.isdigit() and int(value) > limit:
+                return await self._reject(send, limit)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    metrics.increment("limits.rejected_body")
+                    raise RequestTooLarge(f"Request body is larger than {limit} bytes")
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,23 @@
+import asyncio
+import json
+from typing import AsyncIterator, Dict
+
+
+async def stream_ndjson(results: AsyncIterator[Dict]) -> AsyncIterator[str]:
+    """Serialize each result as one line of newline-delimited JSON."""
+    async for result in results:
+        yield json.dumps(result) + "\n"
+
+
+async def drain_events(task: asyncio.Future, events: asyncio.Queue) -> AsyncIterator[Dict]:
+    """
+    Yield events queued while task runs, until it has finished and the queue
+    is empty. The task's own result is left to the caller.
+    """
+    while not task.done() or not events.empty():
+        next_event = asyncio.ensure_future(events.get())
+        await asyncio.wait([next_event, task], return_when=asyncio.FIRST_COMPLETED)
+        if next_event.done():
+            yield next_event.result()
+        else:
+            next_event.cancel()